@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+"""Memory used by the loaded results, per 1,000 results
+
+Every model runs in its own process. 'legacy' is the old model: results as objects with a __dict__ and
+a dict per row, and the lxml tree of every semester page kept alive by its Semester. 'compact' is the
+current one: slotted Result with interned tuple rows, trees freed after extraction.
+
+    $ python3 benchmarks/memory_bench.py --results 5000 --semesters 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lxml import html
+
+from dualisbot.parsers import get_backend
+from dualisbot.resultdata import Result
+from dualisbot.stubserver import StubDualis, Account
+
+
+class LegacyResult:
+    def __init__(self, title, results, final_results):
+        self.title = title
+        self.results = results
+        self.final_results = final_results
+
+def current_rss():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def load(model, semesters, results):
+    account = Account('bench', 'bench', semesters, results // semesters)
+    stub = StubDualis([account])
+    backend = get_backend('lxml')
+    popups = [stub.popup_page(account, module['id']).encode() for sem in account.semesters for module in sem['modules']]
+    sem_pages = [stub.semester_page(account, '1', ['', '', '-N' + sem['id']]).encode() for sem in account.semesters]
+
+    result_class = LegacyResult if model == 'legacy' else Result
+    rss_before = current_rss()
+    tracemalloc.start()
+    loaded = [result_class(*backend.parse_result(body, 'utf-8')) for body in popups]
+    trees = [html.document_fromstring(body) for body in sem_pages] if model == 'legacy' else []
+    python_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        'model': model,
+        'results': len(loaded),
+        'trees': len(trees),
+        # tracemalloc does not see the memory of lxml trees, the rss does
+        'python_kib_per_1000': python_bytes / 1024 / len(loaded) * 1000,
+        'rss_kib_per_1000': (current_rss() - rss_before) / 1024 / len(loaded) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    aa = parser.add_argument
+    aa('--results', type=int, default=5000)
+    aa('--semesters', type=int, default=10)
+    aa('--model', choices=['legacy', 'compact'], help='Only measure this model, in this process')
+    args = parser.parse_args()
+
+    if args.model:
+        print(json.dumps(load(args.model, args.semesters, args.results)))
+        return
+    reports = []
+    for model in ['legacy', 'compact']:
+        output = subprocess.run([sys.executable, __file__, '--model', model, '--results', str(args.results),
+                                 '--semesters', str(args.semesters)], capture_output=True, text=True, check=True).stdout
+        reports.append(json.loads(output))
+    print(f'{"model":10} {"results":>8} {"trees":>6} {"python KiB/1000":>16} {"RSS KiB/1000":>13}')
+    for report in reports:
+        print(f'{report["model"]:10} {report["results"]:8} {report["trees"]:6} '
+              f'{report["python_kib_per_1000"]:16.1f} {report["rss_kib_per_1000"]:13.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+"""Compare buffered and streaming parsing of recorded Dualis pages
+
+The pages are served by a local server in small chunks with a delay in between to simulate
+the network. Reports the time until the tree is available and the peak Python heap usage.
+
+    $ python3 benchmarks/parse_bench.py recorded/*.html
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+from aiohttp import web
+from lxml import html
+
+from dualisbot.pages import parse_stream
+
+
+def make_app(pages, chunk_size, delay):
+    async def handler(request):
+        body = pages[int(request.match_info['index'])]
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+        await response.prepare(request)
+        for start in range(0, len(body), chunk_size):
+            await response.write(body[start:start + chunk_size])
+            await asyncio.sleep(delay)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get('/{index}', handler)
+    return app
+
+async def buffered(response):
+    return html.fromstring(await response.text())
+
+async def measure(session, url, parse):
+    tracemalloc.start()
+    start = time.perf_counter()
+    async with session.get(url) as response:
+        await parse(response)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+async def run(args):
+    pages = [Path(path).read_bytes() for path in args.pages]
+    runner = web.AppRunner(make_app(pages, args.chunk_size, args.delay))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    async with aiohttp.ClientSession() as session:
+        print(f'{"page":40} {"mode":10} {"time-to-tree (ms)":>18} {"peak heap (KiB)":>16}')
+        for i, path in enumerate(args.pages):
+            url = f'http://127.0.0.1:{port}/{i}'
+            for mode, parse in ('buffered', buffered), ('streaming', parse_stream):
+                timings = [await measure(session, url, parse) for _ in range(args.repeat)]
+                elapsed = min(t for t, _ in timings)
+                peak = max(p for _, p in timings)
+                print(f'{Path(path).name[:40]:40} {mode:10} {elapsed * 1000:18.2f} {peak / 1024:16.1f}')
+    await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', nargs='+', help='Recorded html pages')
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--delay', type=float, default=0.001, help='Seconds between two chunks')
+    parser.add_argument('--repeat', type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
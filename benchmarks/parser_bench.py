@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+"""Check that the parser backends extract the same results from popup pages and compare their speed
+
+    $ python3 benchmarks/parser_bench.py recorded/popup*.html
+    $ python3 benchmarks/parser_bench.py --synthetic 50
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dualisbot.parsers import backends
+from dualisbot.stubserver import StubDualis, Account
+
+
+def synthetic_pages(count):
+    account = Account('bench', 'bench', 1, count, seed=random.randrange(1000))
+    stub = StubDualis([account])
+    return { module['id']: stub.popup_page(account, module['id']).encode()
+             for module in account.semesters[0]['modules'] }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', nargs='*', help='Recorded popup pages')
+    parser.add_argument('--synthetic', type=int, default=0, help='Number of generated popup pages to add')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = { path: Path(path).read_bytes() for path in args.pages }
+    pages.update(synthetic_pages(args.synthetic) if args.synthetic else {})
+    if not pages:
+        parser.error('no pages given')
+
+    available = {}
+    for name, backend_class in backends.items():
+        try:
+            available[name] = backend_class()
+        except ImportError:
+            print(f'{name}: not installed, skipped')
+
+    reference = { page: available['lxml'].parse_result(body, 'utf-8') for page, body in pages.items() }
+    for name, backend in available.items():
+        mismatches = [page for page, body in pages.items() if backend.parse_result(body, 'utf-8') != reference[page]]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for body in pages.values():
+                backend.parse_result(body, 'utf-8')
+        per_page = (time.perf_counter() - start) / (args.repeat * len(pages))
+        print(f'{name:12} {per_page * 1e6:10.1f} µs/page   {len(mismatches)} of {len(pages)} pages differ from lxml')
+        for page in mismatches[:5]:
+            print(f'    {page}: {backend.parse_result(pages[page], "utf-8")!r} != {reference[page]!r}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+"""End-to-end poll benchmark against a local stub Dualis server
+
+Runs several polls of a synthetic account (like consecutive cron runs, every poll uses a new
+ClientSession) and reports poll latency, requests per poll, parse time per popup page and peak RSS.
+The stub server runs in the same process, so the RSS includes it.
+
+    $ python3 benchmarks/poll_bench.py --semesters 6 --modules 10 --latency 0.05 --output before.json
+    $ python3 benchmarks/poll_bench.py --semesters 6 --modules 10 --latency 0.05 --compare before.json
+
+Parsing on the event loop against the parse executor, on a large account where every page is parsed:
+
+    $ python3 benchmarks/poll_bench.py --semesters 12 --modules 40 --padding 200000 --cold --executor inline --label inline --output inline.json
+    $ python3 benchmarks/poll_bench.py --semesters 12 --modules 40 --padding 200000 --cold --executor thread --compare inline.json
+
+Tail latency with hedged popup requests, 2% of the requests take a second longer:
+
+    $ python3 benchmarks/poll_bench.py --polls 50 --full-refresh --slow-rate 0.02 --latency 0.05 --label plain --output plain.json
+    $ python3 benchmarks/poll_bench.py --polls 50 --full-refresh --slow-rate 0.02 --latency 0.05 --hedge --compare plain.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dualisbot.config import config
+from dualisbot.metrics import get_metrics
+from dualisbot.parsers import shutdown_executor
+from dualisbot.resultdata import Result, do_output_io
+from dualisbot.scheduler import make_session
+from dualisbot.stubserver import StubDualis, Account, start_server
+from dualisbot.webnav import get_semesters
+
+
+def time_parsing(times):
+    """Record the duration of every Result.from_body call in times"""
+    from_body = Result.from_body.__func__
+    async def timed(cls, body, charset):
+        start = time.perf_counter()
+        result = await from_body(cls, body, charset)
+        times.append(time.perf_counter() - start)
+        return result
+    Result.from_body = classmethod(timed)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+async def poll():
+    get_metrics().start_poll()
+    async with make_session() as session:
+        sems = await get_semesters(session)
+        with contextlib.redirect_stdout(io.StringIO()):
+            await do_output_io(session, sems)
+    get_metrics().finish_poll()
+
+async def run(args):
+    account = Account('bench', 'bench', args.semesters, args.modules)
+    stub = StubDualis([account], latency=args.latency, padding=args.padding, error_rate=args.error_rate,
+                      slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    runner, url = await start_server(stub)
+    data_dir = Path(tempfile.mkdtemp())
+    config.update(url=url, username='bench', password='bench', pushbullet_api_key='', data=data_dir / 'data.json', new=True,
+                  parse_executor=args.executor, parse_workers=args.workers, hedge=args.hedge, deadline=args.deadline,
+                  full_refresh=args.full_refresh)
+    parse_times = []
+    time_parsing(parse_times)
+
+    polls = []
+    try:
+        for i in range(args.polls):
+            if args.cold:
+                # forget everything the previous poll has stored
+                config.cache.clear()
+                shutil.rmtree(data_dir)
+                data_dir.mkdir()
+            if args.change:
+                account.change_grades(args.change, seed=i)
+            requests_before = stub.request_count
+            start = time.perf_counter()
+            await poll()
+            polls.append({ 'latency': time.perf_counter() - start, 'requests': stub.request_count - requests_before })
+    finally:
+        shutdown_executor()
+        await runner.cleanup()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    latencies = [p['latency'] for p in polls]
+    return {
+        'label': args.label,
+        'params': { key: getattr(args, key)
+                    for key in ['semesters', 'modules', 'latency', 'padding', 'error_rate', 'polls', 'cold', 'change', 'executor', 'workers',
+                                 'slow_rate', 'slow_latency', 'hedge', 'deadline', 'full_refresh'] },
+        'polls': polls,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_max': max(latencies),
+        'requests_per_poll': statistics.mean(p['requests'] for p in polls),
+        'parsed_pages': len(parse_times),
+        'parse_mean': statistics.mean(parse_times) if parse_times else None,
+        'parse_p95': percentile(parse_times, 0.95),
+        # kilobytes on Linux
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+metrics = ['latency_p50', 'latency_p95', 'latency_p99', 'latency_max', 'requests_per_poll', 'parsed_pages', 'parse_mean', 'parse_p95', 'peak_rss_kib']
+
+def print_report(result, baseline=None):
+    for metric in metrics:
+        value = result[metric]
+        if value is None:
+            print(f'{metric:20} {"-":>14}')
+            continue
+        line = f'{metric:20} {value:>14.6g}'
+        if baseline is not None and baseline.get(metric):
+            line += f'   {(value - baseline[metric]) / baseline[metric] * 100:+8.1f}% vs {baseline["label"]}'
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    aa = parser.add_argument
+    aa('--semesters', type=int, default=6)
+    aa('--modules', type=int, default=10, help='Modules per semester')
+    aa('--latency', type=float, default=0.0, help='Seconds the stub waits before every response')
+    aa('--padding', type=int, default=20000, help='Filler bytes added to every page')
+    aa('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    aa('--slow-rate', type=float, default=0.0, help='Fraction of requests that take --slow-latency seconds longer')
+    aa('--slow-latency', type=float, default=1.0)
+    aa('--full-refresh', action='store_true', help='Fetch every popup in every poll')
+    aa('--hedge', action='store_true', help='Send slow popup requests a second time')
+    aa('--deadline', type=float, help='Use the stored result for popups that have not arrived after this many seconds')
+    aa('--polls', type=int, default=5)
+    aa('--cold', action='store_true', help='Start every poll without stored session, fingerprints and data')
+    aa('--change', type=float, default=0.0, help='Fraction of the newest modules that get a new grade before every poll')
+    aa('--executor', choices=['inline', 'thread', 'process'], default='thread', help='Where popup pages are parsed')
+    aa('--workers', type=int, help='Size of the parse executor')
+    aa('--label', default='current')
+    aa('--output', help='Write the results to this json file')
+    aa('--compare', help='Print the difference to the results in this json file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import asyncio
+import sys
+import traceback
+
+import aiohttp
+
+from dualisbot.config import current_config
+from dualisbot.resultdata import do_output_io
+from dualisbot.scheduler import make_session
+from dualisbot.webnav import get_semesters, LoginFailed
+
+# Poll many accounts in one process: one connection pool, one cookie jar and one state per account
+
+async def poll_account(account, connector):
+    """Poll one account, account is the Config object of that account"""
+    # Tasks run in a copy of the context, this only affects the current task
+    current_config.set(account)
+    # Own session for the cookie jar, the connection pool is shared
+    async with make_session(connector) as session:
+        try:
+            sems = await get_semesters(session)
+            await do_output_io(session, sems)
+        except (aiohttp.ClientError, asyncio.TimeoutError, LoginFailed) as e:
+            print(f'{account["username"]}: {e!r}', file=sys.stderr)
+        except Exception:
+            # e.g. a maintenance page without the expected elements, one account must not stop the others
+            print(f'{account["username"]}: poll failed', file=sys.stderr)
+            traceback.print_exc()
+
+async def poll_accounts(accounts, connector):
+    # gather wraps every coroutine in its own task
+    await asyncio.gather(*[poll_account(account, connector) for account in accounts], return_exceptions=True)
@@ -1,22 +1,43 @@
 import argparse
 
 from dualisbot.config import config
+from dualisbot.render import formats
+
+def latency(value):
+    return value if value == 'recorded' else float(value)
 
 def parse_args():
     parser = argparse.ArgumentParser()
     aa = parser.add_argument
     aa('-s', '--semester', help='Restrict output to one semester', type=int, choices=range(1,7))
     aa('-n', '--new', help='Only show new results', action='store_true')
+    aa('--full-refresh', help='Fetch all pages, also those that are not due to be checked again', action='store_true')
     aa('-u', '--username', help='Username for Dualis')
     aa('-p', '--password', help='Password for Dualis')
     aa('-pu', '--pushbullet', help='Pushbullet API')
     aa('--json', help='Output to JSON', action='store_true')
+    aa('--format', help='Text output format. Defaults to ansi on a terminal and plain otherwise', choices=formats)
+    aa('--ndjson', help='Output every result as one line of JSON as soon as it has been loaded', action='store_true')
+    aa('-d', '--daemon', help='Keep running and poll Dualis periodically', action='store_true')
+    aa('--serve', help='Poll periodically and answer HTTP requests for the results of the last poll', action='store_true')
+    aa('--host', help='Address the HTTP API listens on in serve mode. Defaults to localhost')
+    aa('--port', help='Port of the HTTP API in serve mode. Defaults to 8080', type=int)
+    aa('--interval', help='Seconds between two polls in daemon mode. Defaults to 900', type=int)
+    aa('--jitter', help='Maximum random delay in seconds added to the interval. Defaults to 60', type=int)
+    aa('--hedge', help='Send popup requests again if they take longer than most recent ones', action='store_true')
+    aa('--deadline', help='Seconds after the start of a poll after which stored results are shown for pages that have not arrived', type=float)
     aa('--secrets', help='Location of file containing username, password and API Key. Defaults to ./data/secrets.json')
     aa('--config', help='Location of config file. Defaults to ./data/config.json')
     aa('--data', help='Location of data file. Defaults to ./data/data.json')
+    aa('--timings', help='Print where the time of every poll went to stderr', action='store_true')
+    aa('--trace', help='Write the requests and processing steps of the last poll with their timings to this json file')
+    aa('--metrics', help='Write request counts, latencies and parse times to this file in the Prometheus text format')
+    aa('--accounts', help='Poll all accounts listed in this json file concurrently')
+    aa('--record', help='Save all responses (without credentials) to an archive in this directory', metavar='DIR')
+    aa('--replay', help='Answer all requests from the archive in this directory instead of the server', metavar='DIR')
+    aa('--replay-latency', help="Seconds to wait before every replayed response, 'recorded' for the recorded durations", type=latency)
+    aa('--profile-startup', help='Print how long importing every module takes and exit', action='store_true')
     args = parser.parse_args()
     for key, value in vars(args).items():
         if value is not None:
             config[key] = value
-
-parse_args()
\ No newline at end of file
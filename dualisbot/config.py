@@ -1,5 +1,6 @@
 import json
 import sys
+from contextvars import ContextVar
 from getpass import getpass
 from pathlib import Path
 
@@ -8,14 +9,25 @@ from pathlib import Path
 def path_complete(path):
     return (Path(sys.argv[0]).parent / path).resolve()
 
-config = {
+class Config(dict):
+    """Config values of one account, also holds the objects that belong to that account (see account_cache)"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = {}
+
+config = Config({
     'url': 'https://dualis.dhbw.de', # Hardcoded here because it should not be configurable
     'secrets': path_complete('data/secrets.json'),
     'config': path_complete('data/config.json'),
     'data': path_complete('data/data.json')
-}
+})
+
+# The account that is being worked on, every task polling an account sets its own
+current_config = ContextVar('current_config', default=config)
 
 secrets_keys = ['username', 'password','pushbullet_api_key' ]
+# Files that belong to one account, they are not inherited from the global config
+account_file_keys = ['data', 'database', 'fingerprints', 'session_cache', 'notify_state', 'refresh_state', 'semester_map']
 did_read_from_input = False
 
 def read_config():
@@ -25,7 +37,10 @@ def read_config():
     load_config()
 
     for config_val in secrets_keys:
-        if get_config_val(config_val) is None:
+        if get_config_val(config_val) is None and get_config_val('replay'):
+            # nothing is sent anywhere
+            config[config_val] = ''
+        elif get_config_val(config_val) is None:
             config[config_val] = get_from_input(config_val)
             did_read_from_input = True
 
@@ -79,5 +94,39 @@ def load_config(file_data):
         if config.get(key) is None and key not in secrets_keys:
             config[key] = value
 
-def get_config_val(name):
-    return config.get(name)
\ No newline at end of file
+def data_file(name):
+    """Path of an auxiliary file that is stored next to the data file"""
+    return Path(get_config_val('data')).parent / name
+
+def read_accounts(path):
+    """Create a Config for every account in the accounts file
+
+    Each account inherits the global config values and has its own data directory next to the accounts file
+    unless it sets 'data'."""
+    path = Path(path).resolve()
+    with open(path) as file:
+        accounts = json.load(file)
+    result = []
+    inherited = { key: value for key, value in config.items() if key not in account_file_keys }
+    for account_vals in accounts:
+        account = Config({ **inherited, **account_vals })
+        if account_vals.get('data') is None:
+            account['data'] = path.parent / 'accounts' / account['username'] / 'data.json'
+        else:
+            account['data'] = path.parent / account_vals['data']
+        Path(account['data']).parent.mkdir(parents=True, exist_ok=True)
+        result.append(account)
+    return result
+
+def account_cache(func):
+    """Call func only once per account and keep the return value in the account's Config"""
+    def wrapper(*args, **kwargs):
+        cache = current_config.get().cache
+        if func.__name__ not in cache:
+            cache[func.__name__] = func(*args, **kwargs)
+        return cache[func.__name__]
+    return wrapper
+
+def get_config_val(name, default=None):
+    value = current_config.get().get(name)
+    return default if value is None else value
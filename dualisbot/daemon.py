@@ -0,0 +1,49 @@
+import asyncio
+import random
+import sys
+import traceback
+
+import aiohttp
+
+from dualisbot.config import get_config_val
+from dualisbot.metrics import get_metrics
+from dualisbot.resultdata import do_output_io
+from dualisbot.webnav import get_semesters, LoginFailed
+
+# Long running mode: one session, one connection pool, log in only when necessary
+
+def next_delay():
+    """Seconds to wait until the next poll"""
+    interval = get_config_val('interval', 900)
+    jitter = get_config_val('jitter', 60)
+    return interval + random.uniform(0, jitter)
+
+def poll_session(session):
+    async def poll():
+        # get_semesters reuses the cached session and logs in again once it has expired
+        sems = await get_semesters(session)
+        await do_output_io(session, sems)
+    return poll
+
+async def run_daemon(poll, on_first_poll=None):
+    """Call the coroutine function poll forever, on_first_poll is called after the first successful poll"""
+    while True:
+        get_metrics().start_poll()
+        try:
+            await poll()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Dualis is down every now and then, try again next time
+            print(f'Poll failed: {e!r}', file=sys.stderr)
+        except LoginFailed:
+            # wrong credentials don't get better by trying again
+            raise
+        except Exception:
+            # e.g. a maintenance page or a session that expired in the middle of the poll
+            print('Poll failed:', file=sys.stderr)
+            traceback.print_exc()
+        else:
+            if on_first_poll is not None:
+                on_first_poll()
+                on_first_poll = None
+        get_metrics().finish_poll()
+        await asyncio.sleep(next_delay())
@@ -0,0 +1,57 @@
+# Compare freshly loaded results with the stored snapshot
+
+def result_key(title, results, final_results):
+    """Hashable representation of everything that is shown for a result"""
+    rows = tuple(tuple(sorted(row.items())) for row in results)
+    return title, rows, final_results
+
+def serialized_key(data):
+    return result_key(data['title'], data['results'], data['final_results'])
+
+
+class SemesterDiff:
+    def __init__(self, semester, added, changed, removed):
+        self.semester = semester
+        # Result objects
+        self.added = added
+        self.changed = changed
+        # Serialized results from the old snapshot
+        self.removed = removed
+
+
+class SemesterIndex:
+    """Keys and titles of the results of a serialized semester (or None)"""
+    def __init__(self, old_sem):
+        self.results = old_sem['results'] if old_sem else []
+        self.keys = { serialized_key(res) for res in self.results }
+        self.titles = { res['title'] for res in self.results }
+
+    def is_new(self, result):
+        return result.key() not in self.keys
+
+    def is_changed(self, result):
+        return result.title in self.titles
+
+def diff_semester(semester, old_sem):
+    """Compare a loaded Semester with its serialized old version (or None), linear in the number of results"""
+    index = SemesterIndex(old_sem)
+    new_titles = { res.title for res in semester.result_infos }
+
+    added, changed = [], []
+    for res in semester.result_infos:
+        if index.is_new(res):
+            (changed if index.is_changed(res) else added).append(res)
+    removed = [res for res in index.results if res['title'] not in new_titles]
+    return SemesterDiff(semester, added, changed, removed)
+
+
+class NewResultFilter:
+    """Check single results against the snapshot as they arrive, the index of a semester is built on first use"""
+    def __init__(self, old_sems_d):
+        self.old_sems_d = old_sems_d
+        self.indexes = {}
+
+    def is_new(self, semester, result):
+        if semester.number not in self.indexes:
+            self.indexes[semester.number] = SemesterIndex(self.old_sems_d.get(semester.number))
+        return self.indexes[semester.number].is_new(result)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import re
+
+from dualisbot.config import get_config_val, data_file, account_cache
+
+# Remember what the popup pages looked like last time, so unchanged pages do not have to be parsed again
+
+session_arg = re.compile('(ARGUMENTS=)-N(\\d+),?')
+
+def session_number(url):
+    """Get the session number from the ARGUMENTS of a Dualis url"""
+    match = session_arg.search(url)
+    return match.group(2) if match else None
+
+def url_key(url):
+    """Url without the session number, stays the same across logins"""
+    return session_arg.sub('\\1', url)
+
+def fingerprint(url, body):
+    """Hash of a page body, ignoring the session number which changes with every login"""
+    sessionno = session_number(url)
+    if sessionno:
+        body = body.replace(sessionno.encode(), b'')
+    return hashlib.sha1(body).hexdigest()
+
+
+class FingerprintIndex:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                self.entries = json.load(file)
+        except (IOError, ValueError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as file:
+                json.dump(self.entries, file)
+        except IOError:
+            pass
+
+    def conditional_headers(self, url):
+        """Request headers that let the server answer with 304 if it supports it"""
+        entry = self.entries.get(url_key(url), {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def cached(self, url, digest=None):
+        """Get the stored (serializable) result for url, None if the page has changed"""
+        entry = self.entries.get(url_key(url))
+        if entry is None or (digest is not None and entry['hash'] != digest):
+            return None
+        return entry['result']
+
+    def store(self, url, digest, headers, result):
+        self.entries[url_key(url)] = {
+            'hash': digest,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'result': result
+        }
+
+
+@account_cache
+def get_fingerprint_index():
+    """Load the index from disk once"""
+    path = get_config_val('fingerprints') or data_file('fingerprints.json')
+    return FingerprintIndex(path).load()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from dualisbot.config import get_config_val, data_file, account_cache
+from dualisbot.metrics import get_metrics
+from dualisbot.pages import fetch
+
+# Against the long tail of the popup pages: a request that takes longer than most recent ones is sent
+# a second time and the first response wins
+
+class Hedger:
+    def __init__(self, path, percentile, budget, min_samples, window):
+        self.path = path
+        self.percentile = percentile
+        # extra requests per request
+        self.budget = budget
+        self.min_samples = min_samples
+        # seconds the recent requests took, kept across runs
+        self.durations = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            get_config_val('hedge_timings') or data_file('timings.json'),
+            get_config_val('hedge_percentile', 0.95),
+            get_config_val('hedge_budget', 0.1),
+            get_config_val('hedge_min_samples', 20),
+            get_config_val('hedge_window', 200)
+        )
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                self.durations.extend(json.load(file))
+        except (IOError, ValueError):
+            pass
+        return self
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as file:
+                json.dump(list(self.durations), file)
+        except IOError:
+            pass
+
+    def threshold(self):
+        """Seconds after which a request is sent again, None as long as there are too few timings"""
+        if len(self.durations) < self.min_samples:
+            return None
+        durations = sorted(self.durations)
+        return durations[min(len(durations) - 1, int(len(durations) * self.percentile))]
+
+    def may_hedge(self):
+        return self.hedges < self.budget * self.requests
+
+    async def fetch(self, session, url, handler, **kwargs):
+        """Like pages.fetch, the handler must not have side effects because it may run twice"""
+        async def attempt():
+            # from the first time the request gets its slot, waiting for the limits says nothing about the server
+            started = []
+            def on_slot():
+                if not started:
+                    started.append(time.perf_counter())
+            try:
+                return await fetch(session, url, handler, on_slot=on_slot, **kwargs)
+            finally:
+                # also the attempts that lose and are cancelled, at least this long they took
+                if started:
+                    self.durations.append(time.perf_counter() - started[0])
+
+        self.requests += 1
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            threshold = self.threshold()
+            if threshold is not None:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                if not done and self.may_hedge():
+                    self.hedges += 1
+                    get_metrics().hedged_requests += 1
+                    tasks.append(asyncio.ensure_future(attempt()))
+            while True:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    return succeeded[0].result()
+                if not pending:
+                    # raise the exception
+                    return done.pop().result()
+                tasks = list(pending)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+@account_cache
+def get_hedger():
+    """Load the recent timings once"""
+    return Hedger.from_config().load()
+
+def fetch_hedged(session, url, handler, **kwargs):
+    """pages.fetch, with hedging if it is enabled with the 'hedge' config value"""
+    if not get_config_val('hedge'):
+        return fetch(session, url, handler, **kwargs)
+    return get_hedger().fetch(session, url, handler, **kwargs)
+
+# perf_counter time of the deadline of the poll in this task, None without deadline
+# The tasks that load the pages are created after it is set and inherit it, every account has its own
+poll_deadline = ContextVar('poll_deadline', default=None)
+
+def start_deadline():
+    """Start the deadline clock, called at the start of every poll"""
+    deadline = get_config_val('deadline')
+    poll_deadline.set(None if deadline is None else time.perf_counter() + deadline)
+
+def deadline_remaining():
+    """Seconds until the deadline of the current poll, None if there is none"""
+    deadline_at = poll_deadline.get()
+    if deadline_at is None:
+        return None
+    return deadline_at - time.perf_counter()
@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from dualisbot.config import get_config_val
+
+# Where the time of a poll goes: request timings from aiohttp trace hooks and spans around the local work
+
+class Histogram:
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_prometheus(self, name, labels=''):
+        bucket_labels = labels + ',' if labels else ''
+        labels = f'{{{labels}}}' if labels else ''
+        lines = [f'{name}_bucket{{{bucket_labels}le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{labels} {self.sum}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        # counted over the lifetime of the process
+        self.requests = Counter()
+        self.request_latency = defaultdict(Histogram)
+        self.bytes_received = 0
+        self.spans = defaultdict(Histogram)
+        self.hedged_requests = 0
+        self.stale_results = 0
+        # events of the current poll
+        self.poll_start = time.perf_counter()
+        self.events = []
+
+    def observe_request(self, method, url, status, start, end):
+        name = url.query.get('PRGNAME') or url.path
+        self.requests[method, str(status)] += 1
+        self.request_latency[name].observe(end - start)
+        event = { 'type': 'request', 'name': name, 'method': method, 'status': status,
+                  'start': start - self.poll_start, 'duration': end - start, 'bytes': 0 }
+        self.events.append(event)
+        return event
+
+    def observe_span(self, name, start, end):
+        self.spans[name].observe(end - start)
+        self.events.append({ 'type': 'span', 'name': name, 'start': start - self.poll_start, 'duration': end - start })
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_span(name, start, time.perf_counter())
+
+    def trace_config(self):
+        """Hooks that record every request of a ClientSession"""
+        import aiohttp
+
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+            ctx.event = None
+
+        async def on_request_end(session, ctx, params):
+            ctx.event = self.observe_request(params.method, params.url, params.response.status, ctx.start, time.perf_counter())
+
+        async def on_request_exception(session, ctx, params):
+            self.observe_request(params.method, params.url, 'error', ctx.start, time.perf_counter())
+
+        async def on_response_chunk_received(session, ctx, params):
+            self.bytes_received += len(params.chunk)
+            if getattr(ctx, 'event', None) is not None:
+                ctx.event['bytes'] += len(params.chunk)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_response_chunk_received.append(on_response_chunk_received)
+        return trace_config
+
+    def timings_table(self):
+        """Time per request/span name for the current poll, slowest first"""
+        groups = defaultdict(list)
+        for event in self.events:
+            groups[event['type'], event['name']].append(event['duration'])
+        lines = [f'{"":8} {"name":30} {"count":>6} {"total ms":>10} {"max ms":>10}']
+        for (type_, name), durations in sorted(groups.items(), key=lambda item: -sum(item[1])):
+            lines.append(f'{type_:8} {name[:30]:30} {len(durations):6} {sum(durations) * 1000:10.1f} {max(durations) * 1000:10.1f}')
+        lines.append(f'poll total: {(time.perf_counter() - self.poll_start) * 1000:.1f} ms')
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        lines = ['# TYPE dualisbot_requests_total counter']
+        lines += [f'dualisbot_requests_total{{method="{method}",status="{status}"}} {count}'
+                  for (method, status), count in self.requests.items()]
+        lines.append('# TYPE dualisbot_request_duration_seconds histogram')
+        for name, histogram in self.request_latency.items():
+            lines += histogram.to_prometheus('dualisbot_request_duration_seconds', f'page="{name}"')
+        lines.append('# TYPE dualisbot_received_bytes_total counter')
+        lines.append(f'dualisbot_received_bytes_total {self.bytes_received}')
+        lines.append('# TYPE dualisbot_hedged_requests_total counter')
+        lines.append(f'dualisbot_hedged_requests_total {self.hedged_requests}')
+        lines.append('# TYPE dualisbot_stale_results_total counter')
+        lines.append(f'dualisbot_stale_results_total {self.stale_results}')
+        lines.append('# TYPE dualisbot_span_duration_seconds histogram')
+        for name, histogram in self.spans.items():
+            lines += histogram.to_prometheus('dualisbot_span_duration_seconds', f'span="{name}"')
+        return '\n'.join(lines) + '\n'
+
+    def start_poll(self):
+        """Called when a poll begins, so the time between polls is not counted"""
+        self.poll_start = time.perf_counter()
+        self.events = []
+
+    def finish_poll(self):
+        """Write the configured outputs for the poll that just ended"""
+        self.observe_span('poll', self.poll_start, time.perf_counter())
+        if get_config_val('timings'):
+            print(self.timings_table(), file=sys.stderr)
+        if get_config_val('trace'):
+            write_atomic(get_config_val('trace'), json.dumps({ 'events': self.events }, indent=4))
+        if get_config_val('metrics'):
+            write_atomic(get_config_val('metrics'), self.to_prometheus())
+
+
+def write_atomic(path, text):
+    """Readers (e.g. the node exporter) never see a half written file"""
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+    except IOError:
+        pass
+
+def get_metrics():
+    """One instance for the whole process"""
+    self = get_metrics
+    if getattr(self, 'cache', None) is None:
+        self.cache = Metrics()
+    return self.cache
+
+def timed(name):
+    """Decorator, records every call of the function as a span"""
+    def dec(func):
+        def wrapper(*args, **kwargs):
+            with get_metrics().span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return dec
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import json
+import sys
+
+import aiohttp
+
+from dualisbot.config import get_config_val, data_file, account_cache
+from dualisbot.diff import serialized_key
+from dualisbot.scheduler import get_scheduler
+
+# Pushbullet notifications, collected during a run and sent as one push at the end
+
+push_title = 'Neue Noten sind da!'
+
+def key_digest(data):
+    return hashlib.sha1(json.dumps(serialized_key(data)).encode()).hexdigest()
+
+
+class Notifier:
+    def __init__(self, api_key, api_url, state_path, channel_num=None):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.state_path = state_path
+        # index into the list of your channels, None to only push to yourself
+        self.channel_num = channel_num
+        self.channel_tag = None
+        self.sent = set()
+        # serialized results that still have to be sent (also the ones a failed run could not send)
+        self.pending = []
+        # key digests of pending
+        self.pending_digests = set()
+        self.load_state()
+
+    @classmethod
+    def from_config(cls):
+        channel_num = get_config_val('pushbullet_channel_num', 0) if get_config_val('use_pushbullet_channel') else None
+        return cls(
+            get_config_val('pushbullet_api_key'),
+            get_config_val('pushbullet_url', 'https://api.pushbullet.com/v2'),
+            get_config_val('notify_state') or data_file('notified.json'),
+            channel_num
+        )
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+                self.sent = set(state.get('sent', []))
+                self.pending = state.get('pending', [])
+                self.pending_digests = set(map(key_digest, self.pending))
+        except (IOError, ValueError):
+            pass
+
+    def save_state(self):
+        try:
+            with open(self.state_path, 'w') as file:
+                json.dump({ 'sent': sorted(self.sent), 'pending': self.pending }, file)
+        except IOError:
+            pass
+
+    def add(self, result):
+        data = result.get_serializable()
+        digest = key_digest(data)
+        if digest not in self.sent and digest not in self.pending_digests:
+            self.pending.append(data)
+            self.pending_digests.add(digest)
+
+    async def request(self, session, method, path, **kwargs):
+        async def read_json(response):
+            response.raise_for_status()
+            return await response.json()
+        return await get_scheduler().run(
+            session, method, self.api_url + path, read_json, headers={ 'Access-Token': self.api_key }, **kwargs)
+
+    async def push_note(self, session, body, **target):
+        await self.request(session, 'POST', '/pushes', json={ 'type': 'note', 'title': push_title, 'body': body, **target })
+
+    async def get_channel_tag(self, session):
+        """Look up the channel once"""
+        if self.channel_tag is None:
+            channels = (await self.request(session, 'GET', '/channels'))['channels']
+            self.channel_tag = [ch for ch in channels if ch.get('active', True)][self.channel_num]['tag']
+        return self.channel_tag
+
+    async def flush(self, session):
+        """Send everything that is pending as one push"""
+        if not self.pending or not self.api_key:
+            return
+        from dualisbot.resultdata import Result
+        results = [Result.from_serializable(data) for data in self.pending]
+        try:
+            await self.push_note(session, '\n\n'.join(res.to_text(color=False) for res in results))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # keep them pending for the next run
+            print(f'Sending Pushbullet notification failed: {e!r}', file=sys.stderr)
+            self.save_state()
+            return
+        self.sent.update(self.pending_digests)
+        self.pending = []
+        self.pending_digests = set()
+        self.save_state()
+
+        # If you manually created a pushbullet channel for your course
+        if self.channel_num is not None:
+            anon_text = '\n'.join('Im Fach: ' + res.title for res in results)
+            try:
+                await self.push_note(session, anon_text, channel_tag=await self.get_channel_tag(session))
+            except (aiohttp.ClientError, asyncio.TimeoutError, IndexError, KeyError) as e:
+                print(f'Sending Pushbullet channel notification failed: {e!r}', file=sys.stderr)
+
+
+@account_cache
+def get_notifier():
+    """Create the notifier once per account"""
+    return Notifier.from_config()
@@ -0,0 +1,54 @@
+from urllib.parse import urlparse, urlunparse
+
+from lxml import html
+
+from dualisbot.config import get_config_val
+from dualisbot.scheduler import get_scheduler
+
+# Fetching and parsing single pages, used by webnav and resultdata
+
+class PageInfo:
+    def __init__(self, session, url, page):
+        self.session = session
+        self.url = url 
+        self.page = page
+
+    @classmethod
+    async def init(cls, session, url):
+        async def parse(response):
+            if get_config_val('stream_parse', True):
+                page = await parse_stream(response)
+            else:
+                page = html.fromstring(await response.text())
+            return cls(session, url, page)
+        return await fetch(session, url, parse)
+
+    @classmethod
+    async def copy_session(cls, pageinfo, url):
+        return await cls.init(pageinfo.session, url)
+
+    @classmethod
+    async def from_relurl(cls, session, relurl, base_url):
+        return await cls.init(session, relurl_to_url(relurl, base_url))
+    
+    @classmethod
+    async def copy_relurl(cls, pageinfo, relurl):
+        return await cls.from_relurl(pageinfo.session, relurl, pageinfo.url)
+    
+
+async def parse_stream(response):
+    """Build the tree while the body is still arriving instead of buffering it first"""
+    parser = html.HTMLParser(encoding=response.charset)
+    async for chunk in response.content.iter_chunked(get_config_val('chunk_size', 16384)):
+        parser.feed(chunk)
+    return parser.close()
+
+def fetch(session, url, handler, method='GET', **kwargs):
+    """All requests go through here, see RequestScheduler.run"""
+    return get_scheduler().run(session, method, url, handler, **kwargs)
+
+def relurl_to_url(relurl, base_url):
+    """Append a page-relative url to a full url"""
+    relurl = urlparse(relurl)
+    base_url = urlparse(base_url)
+    return urlunparse(base_url[:2] + relurl[2:])
@@ -0,0 +1,172 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from lxml import etree, html
+
+from dualisbot.config import get_config_val
+
+# Extraction of the popup pages, with exchangeable HTML parsers
+# A backend turns the body of a popup page into (title, results, final_results)
+
+title_re = re.compile('\\s*(.*)$')
+# Note: the td element that should contain the final grade is actually invalid html if no
+# grade has been set (this is a bug on website)
+# It is still parsed mostly correct as a td element, but the text ends up inside the tag (where the attributes should be)
+broken_td_re = re.compile('^<[^>]*"\\s*(.*)\\s*>')
+
+find_title = etree.XPath('//h1')
+find_table = etree.XPath('./following-sibling::table')
+
+def trim_space(string):
+    if not string or string.isspace():
+        return None
+    return string.strip()
+
+def parse_title(text):
+    match = title_re.search(text or '')
+    return match.group(1) if match else ''
+
+class TableExtractor:
+    """Collects headers and result rows of the results table in one pass over the rows
+
+    Feed every row as a list of (classes, text) tuples, one for each cell"""
+    def __init__(self):
+        # All headers visible on the page
+        self.headers = []
+        self.results = []
+
+    def add_row(self, cells):
+        if not cells:
+            return
+        first_classes = cells[0][0]
+        if 'tbsubhead' in first_classes:
+            self.headers += [text for _, text in cells if text and not text.isspace()]
+        elif 'tbdata' in first_classes:
+            result = {}
+            for i, (_, text) in enumerate(cells):
+                text = trim_space(text)
+                if text and i < len(self.headers):
+                    result[self.headers[i]] = text
+            self.results.append(result)
+
+
+def extract_result(page):
+    """Get (title, results, final_results) from the lxml tree of a popup page"""
+    htmltitle = find_title(page)[0]
+    htmltable = find_table(htmltitle)[0]
+    extractor = TableExtractor()
+    last_row = None
+    for tr in htmltable:
+        if tr.tag == 'tr':
+            last_row = tr.getchildren()
+            extractor.add_row([(td.classes, td.text) for td in last_row])
+
+    final_results_td = last_row[3]
+    final_results = trim_space((final_results_td.text or '').replace('\xa0', ' '))
+    if not final_results:
+        match = broken_td_re.match(html.tostring(final_results_td, encoding='unicode'))
+        if match:
+            final_results = match.group(1)
+    return parse_title(htmltitle.text), extractor.results, final_results
+
+
+class LxmlBackend:
+    name = 'lxml'
+
+    def parse(self, body, charset):
+        """Parse an already downloaded body without decoding it to str first"""
+        return html.document_fromstring(body, parser=html.HTMLParser(encoding=charset))
+
+    def parse_result(self, body, charset):
+        return extract_result(self.parse(body, charset))
+
+class SelectolaxBackend:
+    """Uses the lexbor parser of the selectolax package (pip install selectolax)"""
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self.parser_class = LexborHTMLParser
+
+    def parse_result(self, body, charset):
+        # lexbor reads bytes as utf-8, only other charsets have to be decoded first
+        if charset is not None and charset.lower() not in ('utf-8', 'utf8'):
+            body = body.decode(charset, errors='replace')
+        tree = self.parser_class(body)
+        htmltitle = tree.css_first('h1')
+        htmltable = htmltitle.next
+        while htmltable.tag != 'table':
+            htmltable = htmltable.next
+        extractor = TableExtractor()
+        last_row = None
+        # the html5 parser puts the rows into a tbody element
+        for tr in htmltable.css('tr'):
+            last_row = [td for td in tr.iter() if td.tag in ('td', 'th')]
+            extractor.add_row([((td.attributes.get('class') or '').split(), leading_text(td)) for td in last_row])
+
+        final_results_td = last_row[3]
+        final_results = trim_space((leading_text(final_results_td) or '').replace('\xa0', ' '))
+        if not final_results:
+            # the words of the broken td end up as attributes without value
+            final_results = ' '.join(name for name, value in final_results_td.attributes.items() if not value) or None
+        return parse_title(htmltitle.text(deep=False)), extractor.results, final_results
+
+def leading_text(node):
+    """Text before the first child element, like the text property of lxml elements"""
+    child = node.child
+    if child is None or child.tag != '-text':
+        return None
+    return child.text()
+
+backends = {
+    'lxml': LxmlBackend,
+    'selectolax': SelectolaxBackend
+}
+
+def get_backend(name=None):
+    """The parser backend chosen with the 'parser' config value, created once per process"""
+    name = name or get_config_val('parser', 'lxml')
+    self = get_backend
+    if getattr(self, 'cache', None) is None:
+        self.cache = {}
+    if name not in self.cache:
+        self.cache[name] = backends[name]()
+    return self.cache[name]
+
+
+# Parsing popup pages off the event loop
+# lxml and lexbor release the GIL while parsing, so a thread pool already parses in parallel with fetching.
+# Only bytes go in and plain tuples come out, which makes the process pool work the same way.
+
+executors = {
+    'inline': None,
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+def parse_in_worker(backend_name, body, charset):
+    """Runs in the executor, has to be a module level function for the process pool"""
+    return get_backend(backend_name).parse_result(body, charset)
+
+def get_executor():
+    """The pool chosen with the 'parse_executor' config value, None for parsing on the event loop"""
+    self = get_executor
+    if not hasattr(self, 'cache'):
+        executor_class = executors[get_config_val('parse_executor', 'thread')]
+        self.cache = executor_class and executor_class(max_workers=get_config_val('parse_workers'))
+    return self.cache
+
+def shutdown_executor():
+    self = get_executor
+    if getattr(self, 'cache', None) is not None:
+        self.cache.shutdown()
+    self.__dict__.pop('cache', None)
+
+async def parse_result(body, charset):
+    """(title, results, final_results) of a downloaded popup page"""
+    backend_name = get_config_val('parser', 'lxml')
+    executor = get_executor()
+    if executor is None:
+        return parse_in_worker(backend_name, body, charset)
+    return await asyncio.get_running_loop().run_in_executor(executor, parse_in_worker, backend_name, body, charset)
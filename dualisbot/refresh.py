@@ -0,0 +1,100 @@
+import json
+import time
+
+from dualisbot.config import get_config_val, data_file, account_cache
+from dualisbot.fingerprint import url_key
+from dualisbot.storage import get_store
+
+# Which semester and popup pages have to be fetched again
+# Grades only change until they are final, and a final grade that has not changed for a long time
+# is checked less and less often. Every full_refresh_interval everything is fetched anyway.
+
+not_set = 'noch nicht gesetzt'
+
+def is_final(result):
+    """Whether a (serialized) result has its final grade"""
+    final_results = result.get('final_results')
+    return bool(final_results) and not_set not in final_results
+
+
+class RefreshPlanner:
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        # key -> time of the last fetch, keys are 'semester:<number>' and popup urls without session number
+        self.checked = {}
+        self.last_full = 0
+        self.now = time.time()
+        self.full = True
+        # number of the newest semester of the current poll
+        self.newest = None
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+            self.checked = state.get('checked', {})
+            self.last_full = state.get('last_full', 0)
+        except (IOError, ValueError):
+            pass
+        return self
+
+    def save(self):
+        if self.full:
+            self.last_full = self.now
+        try:
+            with open(self.path, 'w') as file:
+                json.dump({ 'last_full': self.last_full, 'checked': self.checked }, file)
+        except IOError:
+            pass
+
+    def start_poll(self):
+        self.now = time.time()
+        self.full = (not get_config_val('adaptive_refresh', True) or get_config_val('full_refresh')
+                     or self.now - self.last_full >= get_config_val('full_refresh_interval', 7 * 86400))
+
+    def interval(self, last_change):
+        """Time between two checks, grows with the time since the last change"""
+        age = self.now - last_change if last_change else 0
+        interval = max(age * get_config_val('refresh_factor', 0.25), get_config_val('refresh_min_interval', 3600))
+        return min(interval, get_config_val('refresh_max_interval', 2 * 86400))
+
+    def due(self, key, last_change):
+        return self.now - self.checked.get(key, 0) >= self.interval(last_change)
+
+    def semester_due(self, sem, newest, stored):
+        # the newest semester is always fetched, new modules show up there
+        if self.full or sem.number == newest or not stored or not stored['results']:
+            return True
+        if not all(map(is_final, stored['results'])):
+            return True
+        return self.due(f'semester:{sem.number}', self.store.last_change(sem.number))
+
+    def plan(self, semesters):
+        """Give the semesters that are not due their stored results, so their pages are not fetched"""
+        from dualisbot.resultdata import Result
+        old = self.store.load()
+        self.newest = max((sem.number for sem in semesters), default=None)
+        for sem in semesters:
+            stored = old.get(sem.number)
+            if self.semester_due(sem, self.newest, stored):
+                self.checked[f'semester:{sem.number}'] = self.now
+            elif sem.result_infos is None:
+                sem.result_infos = [Result.from_serializable(res) for res in stored['results']]
+
+    def module_due(self, semester, url, cached):
+        """cached is the result stored in the fingerprint index"""
+        # failed attempts and corrections show up in the newest semester, even for final grades
+        if self.full or semester == self.newest or cached is None or not is_final(cached):
+            return True
+        return self.due(url_key(url), self.store.last_change(semester, cached['title']))
+
+    def module_checked(self, url):
+        self.checked[url_key(url)] = self.now
+
+
+@account_cache
+def get_refresh_planner():
+    """Load the refresh state once"""
+    path = get_config_val('refresh_state') or data_file('refresh.json')
+    return RefreshPlanner(path, get_store()).load()
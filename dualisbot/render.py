@@ -0,0 +1,167 @@
+import csv
+import io
+import sys
+import textwrap
+from itertools import zip_longest
+from shutil import get_terminal_size
+
+# Turning results into text, the layout of a result is computed once and shared by all formats
+
+max_col_width = 35 # Chosen arbitrarily
+formats = ['ansi', 'plain', 'markdown', 'csv']
+
+class Layout:
+    """Headers, column width and wrapped lines of one result"""
+    def __init__(self, result, termwidth, label=None):
+        # Necessary headers
+        self.headers = result.headers
+        # Get column width
+        width = termwidth - (len(self.headers) - 1) # Subtract spaces between columns
+        self.col_width = min(width // max(len(self.headers), 1), max_col_width)
+
+        self.title = f'{label}: {display_title(result)}' if label else display_title(result)
+        self.header_lines = self.table_row(self.headers)
+        self.row_lines = [self.table_row([value or '' for value in row]) for row in result.rows]
+        self.final_lines = self.table_row(['Gesamt:', '', result.final_results or ''])
+
+    def table_row(self, columns):
+        width = self.col_width
+        wrapped = [textwrap.wrap(col, width=width) for col in columns]
+        return [' '.join(col.ljust(width) for col in line) for line in zip_longest(*wrapped, fillvalue='')]
+
+    def to_text(self, color):
+        if color:
+            # only colored output needs colorama
+            from colorama import Style, Fore
+            def colored(fore, lines):
+                return fore + '\n'.join(lines) + Style.RESET_ALL
+            blue, green, yellow = Fore.LIGHTBLUE_EX, Fore.LIGHTGREEN_EX, Fore.LIGHTYELLOW_EX
+        else:
+            def colored(fore, lines):
+                return '\n'.join(lines)
+            blue = green = yellow = None
+
+        return '\n'.join([
+            colored(blue, [self.title]),
+            colored(green, self.header_lines),
+            '\n'.join(line for lines in self.row_lines for line in lines),
+            colored(yellow, self.final_lines)
+        ]) + '\n'
+
+
+def display_title(result):
+    return result.title + ' [stale]' if result.stale else result.title
+
+def result_to_text(result, color=False, termwidth=None):
+    termwidth = termwidth or get_terminal_size()[0]
+    if color:
+        init_colorama()
+    return Layout(result, termwidth).to_text(color)
+
+def markdown_cell(text):
+    return (text or '').replace('|', '\\|').replace('\n', ' ')
+
+def result_to_markdown(result):
+    headers = result.headers or ('',)
+    lines = [
+        f'### {markdown_cell(display_title(result))}',
+        '',
+        '| ' + ' | '.join(map(markdown_cell, headers)) + ' |',
+        '|' + '---|' * len(headers)
+    ]
+    lines += ['| ' + ' | '.join(map(markdown_cell, row)) + ' |' for row in result.rows]
+    lines.append(f'\n**Gesamt:** {markdown_cell(result.final_results)}\n')
+    return '\n'.join(lines) + '\n'
+
+
+class Renderer:
+    """Writes results in one of the formats
+
+    On a terminal every result is written with one write as soon as it is added,
+    otherwise (pipes, files) everything is written at once by finish, in semester and page order.
+    Markdown is always written by finish, every semester has one heading.
+    label (the username when polling several accounts) is put in front of every result."""
+    def __init__(self, fmt, out=None, buffered=None, label=None):
+        self.fmt = fmt
+        self.label = label
+        if fmt == 'ansi':
+            init_colorama()
+        self.out = out or sys.stdout
+        self.buffered = fmt == 'markdown' or (not self.out.isatty() if buffered is None else buffered)
+        self.termwidth = get_terminal_size()[0]
+        self.parts = []
+        # (semester, result) in the order they arrived, rendered by finish when buffered
+        self.added = []
+        self.last_sem = None
+        if fmt == 'csv' and not csv_header_written(self.out):
+            header = ['semester', 'title', 'attempt', 'column', 'value', 'final_results']
+            self.write(self.csv_rows([['account'] + header if label else header]))
+
+    def write(self, text):
+        if self.buffered:
+            self.parts.append(text)
+        else:
+            self.out.write(text)
+            self.out.flush()
+
+    def csv_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def render(self, sem, res):
+        if self.fmt == 'csv':
+            title = display_title(res)
+            rows = [[sem.name, title, i, column, value, res.final_results]
+                    for i, row in enumerate(res.rows, 1) for column, value in zip(res.headers, row) if value is not None]
+            rows = rows or [[sem.name, title, '', '', '', res.final_results]]
+            return self.csv_rows([[self.label] + row for row in rows] if self.label else rows)
+        # separate semesters
+        if self.fmt == 'markdown':
+            name = f'{self.label}: {sem.name}' if self.label else sem.name
+            text = f'## {markdown_cell(name)}\n\n' if sem is not self.last_sem else ''
+            return text + result_to_markdown(res)
+        text = '\n' if self.last_sem is not None and sem is not self.last_sem else ''
+        return text + Layout(res, self.termwidth, self.label).to_text(self.fmt == 'ansi')
+
+    def add(self, sem, res):
+        if self.buffered:
+            self.added.append((sem, res))
+            return
+        self.write(self.render(sem, res))
+        self.last_sem = sem
+
+    def finish(self, semesters=None):
+        """semesters gives the order of the buffered results, without it they are written as they arrived"""
+        added = self.added
+        if semesters is not None:
+            shown = { id(res) for _, res in added }
+            added = [(sem, res) for sem in semesters for res in sem.result_infos or () if id(res) in shown]
+        for sem, res in added:
+            self.parts.append(self.render(sem, res))
+            self.last_sem = sem
+        self.added = []
+        if self.parts:
+            self.out.write(''.join(self.parts))
+            self.out.flush()
+            self.parts = []
+
+def csv_header_written(out):
+    """The accounts share stdout, only the first renderer writes the header"""
+    self = csv_header_written
+    if not hasattr(self, 'outs'):
+        self.outs = set()
+    written = id(out) in self.outs
+    self.outs.add(id(out))
+    return written
+
+def init_colorama():
+    """Only needed for colored output, wraps sys.stdout on Windows so do it before anyone holds on to it"""
+    self = init_colorama
+    if not getattr(self, 'done', False):
+        import colorama
+        colorama.init()
+        self.done = True
+
+def default_format():
+    return 'ansi' if sys.stdout.isatty() else 'plain'
@@ -1,142 +1,86 @@
-usePushbulletChannel = False
-channelnum = 0 # by default uses your first channel, for a manual channel use tag from "print(pb.channels)"
-
 import asyncio
-import copy
 import json
-import re
-import textwrap
-from itertools import zip_longest
-from shutil import get_terminal_size
+import sys
 
-import colorama
-from colorama import Style, Fore, Back
-from lxml import html
+from lxml import etree
 
-from dualisbot import webnav
 from dualisbot.config import get_config_val
+from dualisbot.diff import result_key, NewResultFilter
+from dualisbot.fingerprint import get_fingerprint_index, fingerprint
+from dualisbot.hedging import get_hedger, fetch_hedged, deadline_remaining, start_deadline
+from dualisbot.metrics import get_metrics, timed
+from dualisbot.notify import get_notifier
+from dualisbot.pages import PageInfo, relurl_to_url
+from dualisbot.parsers import extract_result, parse_result
+from dualisbot.refresh import get_refresh_planner
+from dualisbot.render import Renderer, default_format, result_to_text
+from dualisbot.storage import get_store
 
-from pushbullet import Pushbullet
 # Result extraction and printing
 
-colorama.init()
+find_selected_option = etree.XPath('//option[@selected = "selected"]')
+count_following_options = etree.XPath('count(./following-sibling::option)', smart_strings=False)
+find_popup_links = etree.XPath('//a[starts-with(@id, "Popup_details")]/@href', smart_strings=False)
 
-def trim_space(string):
-    if not string or string.isspace():
-        return None
-    return string.strip()
+def intern(value):
+    return value if value is None else sys.intern(value)
 
 class Result:
+    """One module, every row is a tuple with the values for the headers (None if the row has none)
+
+    Headers and values are interned, the same few strings appear in every result"""
+    __slots__ = ('title', 'headers', 'rows', 'final_results', 'stale')
+
     def __init__(self, title, results, final_results):
         self.title = title
-        self.results = results
-        self.final_results = final_results
+        # True for a stored result used because the page did not arrive in time
+        self.stale = False
+        headers = list({ column: None for row in results for column in row })
+        self.headers = tuple(map(sys.intern, headers))
+        self.rows = tuple(tuple(intern(row.get(column)) for column in headers) for row in results)
+        self.final_results = intern(final_results)
+
+    @property
+    def results(self):
+        """The rows as dicts, like they are stored"""
+        return [{ column: value for column, value in zip(self.headers, row) if value is not None } for row in self.rows]
 
     @classmethod
     def from_pageinfo(cls, pageinfo):
         """Parse popup page into a more convenient datastructure"""
-        htmltitle = pageinfo.page.xpath('//h1')[0]
-        htmltable = htmltitle.xpath('./following-sibling::table')[0]
-        table = [tr.getchildren() for tr in htmltable.getchildren() if tr.tag == 'tr']
+        return cls(*extract_result(pageinfo.page))
+
+    @classmethod
+    async def from_body(cls, body, charset):
+        """Parse the downloaded popup page with the configured parser backend and executor"""
+        # includes the time waiting for a free worker
+        with get_metrics().span('parse'):
+            return cls(*await parse_result(body, charset))
+
+    def to_text(self, color=True):
+        return result_to_text(self, color)
 
-        title_match = re.search('\\s*(.*)$', htmltitle.text)
-        title = title_match.group(1) if title_match else ''
-        
-        # All headers visible on the page
-        all_headers = []
-        for row in table:
-            for td in row:
-                if 'tbsubhead' in row[0].classes and not td.text.isspace():
-                    all_headers.append(td.text)
-        
-        results = []
-        for row in table:
-            if len(row) > 0 and 'tbdata' in row[0].classes:
-                result = {}
-                for i, td in enumerate(row):
-                    text = trim_space(td.text)
-                    if text and i < len(all_headers):
-                        result[all_headers[i]] = text
-                results.append(result)
-        
-        final_results_td = table[-1][3]
-        final_results = trim_space(final_results_td.text.replace('\xa0', ' '))
-        # Note: the td element that should contain the final grade is actually invalid html if no
-        # grade has been set (this is a bug on website)
-        # It is still parsed mostly correct as a td element, but the text ends up inside the tag (where the attributes should be) 
-        if not final_results:
-            match = re.match('^<[^>]*"\\s*(.*)\\s*>', html.tostring(final_results_td, encoding='unicode'))
-            if match:
-                final_results = match.group(1)
-
-        return cls(title, results, final_results)
-
-    def pretty_print(self):
-        max_col_width = 35 # Chosen arbitrarily
-
-        # Necessary headers
-        # Using a dict for set operations because dicts preserve insertion order
-        headers = list({ column : None for result in self.results for column in result.keys() }.keys())
-
-        # Get column width
-        termwidth, _ = get_terminal_size()
-        termwidth -= len(headers) - 1 # Subtract spaces between columns
-        col_width = min(termwidth // len(headers), max_col_width)
-
-        def table_row(columns):
-            return (
-                '\n'.join(
-                    map(
-                        lambda row: ' '.join([col.ljust(col_width) for col in row]),
-                        zip_longest(*[textwrap.wrap(col, width=col_width) for col in columns], fillvalue=''))))
-
-
-        title_str = Fore.LIGHTBLUE_EX + self.title + Style.RESET_ALL
-        title_str_clean = self.title
-
-        headers_str = Fore.LIGHTGREEN_EX + table_row(headers) + Style.RESET_ALL
-        headers_str_clean = table_row(headers)
-
-        res_strings = []
-        res_strings_clean = []
-        for result in self.results:
-            res_strings.append(table_row([result.get(column, '') for column in headers]))
-        results_str = '\n'.join(res_strings)
-        for result in self.results:
-            res_strings_clean.append(table_row([result.get(column, '') for column in headers]))
-        results_str_clean = '\n'.join(res_strings_clean)
-
-        final_res_str = Fore.LIGHTYELLOW_EX + table_row(['Gesamt:', '',  self.final_results]) + Style.RESET_ALL
-        final_res_str_clean = table_row(['Gesamt:', '',  self.final_results])
-
-        list1 = []
-        print(title_str)
-        print(headers_str)
-        print(results_str)
-        print(final_res_str)
-        
-        #list1 = [title_str, headers_str, results_str, final_res_str]
-        list1 = [title_str_clean, headers_str_clean, results_str_clean, final_res_str_clean]
-        #print("------From List-----")
-        #print('s=%s' % str(list1))
-        pb = Pushbullet(get_config_val('pushbullet_api_key')) 
-        clean_text = title_str_clean + headers_str_clean + results_str_clean + final_res_str_clean
-        anon_text = "Im Fach: " + title_str_clean
-        push = pb.push_note("Neue Noten sind da!", clean_text)
-        # If you manually created a pushbullet channel for your course
-        if usePushbulletChannel == True:
-            my_channel = pb.channels[channelnum] # by default uses your first channel, for a manual channel use tag from "print(pb.channels)"
-            push = my_channel.push_note("Neue Noten sind da!", anon_text)
     @classmethod
     def from_serializable(cls, data):
         return cls(*map(data.get, ['title', 'results', 'final_results']))
 
+    def key(self):
+        return result_key(self.title, self.results, self.final_results)
+
     def get_serializable(self):
         """Get a representation of the object that can be serialized using the builtin json module"""
-        return self.__dict__
+        return { 'title': self.title, 'results': self.results, 'final_results': self.final_results }
+
+    def get_output(self):
+        """Like get_serializable, for the json outputs"""
+        if self.stale:
+            return { **self.get_serializable(), 'stale': True }
+        return self.get_serializable()
 
 
 class Semester:
+    __slots__ = ('name', 'number', '_async_get_pageinfo', 'pageinfo', 'result_infos')
+
     def __init__(self, name, number, async_get_pageinfo):
         self.name = name
         self.number = number
@@ -146,10 +90,10 @@ class Semester:
 
     @classmethod
     def from_pageinfo(cls, pageinfo):
-        selected = pageinfo.page.xpath('//option[@selected = "selected"]')[0]
+        selected = find_selected_option(pageinfo.page)[0]
         # First semester is at the bottom of the drop-down menu, count following options
-        number = len(selected.xpath('./following-sibling::option')) + 1
-        semester = cls(selected.text, number, aw_wrap(pageinfo))
+        number = int(count_following_options(selected)) + 1
+        semester = cls(selected.text, number, page_loader(pageinfo.session, pageinfo.url))
         semester.pageinfo = pageinfo
         return semester
 
@@ -163,18 +107,39 @@ class Semester:
         return obj
 
     async def load_page(self):
-        if self.pageinfo is None:
+        if self.pageinfo is None or self.pageinfo.page is None:
             self.pageinfo = await self._async_get_pageinfo()
 
+    async def iter_results(self):
+        """Yield the results in the order their pages arrive
+
+        Once all have arrived, result_infos contains them in page order"""
+        if self.result_infos is not None:
+            for res in self.result_infos:
+                yield res
+            return
+        await self.load_page()
+        # Get links to the popup pages
+        relurls = find_popup_links(self.pageinfo.page)
+        # only session and url are needed from here on, free the tree
+        self.pageinfo.page = None
+        async def load_indexed(i, relurl):
+            return i, await load_result(self.pageinfo, relurl, self.number)
+        tasks = [asyncio.ensure_future(load_indexed(i, relurl)) for i, relurl in enumerate(relurls)]
+        results = [None] * len(tasks)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, res = await next_done
+                results[i] = res
+                yield res
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.result_infos = results
+
     async def load_results(self):
-        if self.result_infos is None:
-            await self.load_page()
-            # Get links to the popup pages
-            pageinfos = [
-                webnav.PageInfo.copy_relurl(self.pageinfo, relurl)
-                for relurl in self.pageinfo.page.xpath('//a[starts-with(@id, "Popup_details")]/@href')
-            ]
-            self.result_infos = list(map(Result.from_pageinfo, await asyncio.gather(*pageinfos)))
+        async for _ in self.iter_results():
+            pass
 
     def get_serializable(self):
         """Dump relevant information to dict
@@ -186,107 +151,181 @@ class Semester:
             'results': [res.get_serializable() for res in self.result_infos]
         }
 
-    def pretty_print(self):
-        for res in self.result_infos:
-            res.pretty_print()
-
+    def get_output(self, results=None):
+        """Like get_serializable, for the json outputs, optionally only with some of the results"""
+        return {
+            'name': self.name,
+            'number': self.number,
+            'results': [res.get_output() for res in (self.result_infos if results is None else results)]
+        }
 
-def sems_to_json(semesters):
-    """Dump list of semesters to json""" 
-    return json.dumps([sem.get_serializable() for sem in semesters], indent=4)
 
-def sems_to_dict(semesters):
-    return { sem.number: sem.get_serializable() for sem in semesters}
+async def load_result(pageinfo, relurl, semester=None):
+    """Fetch a popup page if it is due, only parse it if it has changed since the last run"""
+    index = get_fingerprint_index()
+    url = relurl_to_url(relurl, pageinfo.url)
+    planner = get_refresh_planner()
+    cached = index.cached(url)
+    if not planner.module_due(semester, url, cached):
+        return Result.from_serializable(cached)
+    async def read(response):
+        if response.status == 304 and index.cached(url) is not None:
+            return None
+        return await response.read(), response.charset, response.headers
+    # parse after the request has given back its slot, so the next page can be fetched meanwhile
+    fetching = fetch_hedged(pageinfo.session, url, read, headers=index.conditional_headers(url))
+    remaining = deadline_remaining()
+    if remaining is None or cached is None:
+        downloaded = await fetching
+    else:
+        try:
+            downloaded = await asyncio.wait_for(fetching, max(remaining, 0))
+        except asyncio.TimeoutError:
+            # too late, show what we had last time
+            get_metrics().stale_results += 1
+            result = Result.from_serializable(cached)
+            result.stale = True
+            return result
+    planner.module_checked(url)
+    if downloaded is None:
+        return Result.from_serializable(index.cached(url))
+    body, charset, headers = downloaded
+    digest = fingerprint(url, body)
+    cached = index.cached(url, digest)
+    if cached is not None:
+        result = Result.from_serializable(cached)
+    else:
+        result = await Result.from_body(body, charset)
+    index.store(url, digest, headers, result.get_serializable())
+    return result
 
-def sems_pretty_print(semesters):
-    """Pretty print list of semesters"""
-    if semesters:
-        for sem in semesters[:-1]:
-            sem.pretty_print()
-            print
-            # print newline if something has been printed
-            if list(sem.result_infos):
-                print()
-                return()
-        semesters[-1].pretty_print()
 
+async def stream_results(semesters):
+    """Yield (semester, result) for the results of all semesters as they arrive"""
+    queue = asyncio.Queue()
+    async def produce(sem):
+        try:
+            async for res in sem.iter_results():
+                await queue.put((sem, res))
+        finally:
+            # one None per finished semester
+            await queue.put(None)
+    tasks = [asyncio.ensure_future(produce(sem)) for sem in semesters]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is None:
+                remaining -= 1
+            else:
+                yield item
+        # raise the exceptions of failed semesters
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 def get_old_sems_dict():
-    """Read the data file from disk and cache the result"""
-    self = get_old_sems_dict
-    if getattr(self, 'cache', None) is None:
-        try:
-            with open(get_config_val('data')) as file:
-                data = json.load(file)
-                self.cache = { sem['number']: sem for sem in data }
-        except IOError:
-            self.cache = {}
-    return copy.deepcopy(self.cache)
-
-
-def get_new_res(semesters):
-    """Remove all results and semesters that are present in old_sems_dicts"""
-    sems_d = sems_to_dict(semesters)
-    old_sems_d = get_old_sems_dict()
-    diff_sems = []
-    for key, sem in sems_d.items():
-        if old := old_sems_d.get(key):
-            results = sem['results']
-            sem['results'] = [r for r in results if r not in old['results']]
-            diff_sems.append(Semester.from_serializable(sem))
-            # restore original
-            sem['results'] = results
-        else:
-            diff_sems.append(Semester.from_serializable(sem))
-    return diff_sems
+    """Get the results of previous runs from the store
+
+    The returned dict is shared, do not modify it"""
+    return get_store().load()
+
 
 async def do_output_io(session, semesters):
-    """Print the data and update the data file"""
+    """Print the data and update the data file
+
+    Results are filtered, printed and queued for notification as soon as their page has arrived"""
+    start_deadline()
     to_display = get_config_val('semester')
     if to_display is not None:
         display_sems = [sem for sem in semesters if sem.number == to_display]
     else:
         display_sems = semesters
 
-    # Load all websites 'concurrently'
-    await asyncio.gather(*[sem.load_results() for sem in display_sems])
+    planner = get_refresh_planner()
+    planner.start_poll()
+    planner.plan(display_sems)
 
     #checks if anything was updated/ is new
-    if get_config_val('new'):
-        output_sems_format(get_new_res(display_sems))
-    else:
-        output_sems_format(display_sems)
+    new_filter = NewResultFilter(get_old_sems_dict()) if get_config_val('new') else None
+    output = get_output()
+    notifier = get_notifier()
+    # Load all websites 'concurrently'
+    async for sem, res in stream_results(display_sems):
+        if new_filter is not None:
+            with get_metrics().span('diff'):
+                if not new_filter.is_new(sem, res):
+                    continue
+        output.add(sem, res)
+        notifier.add(res)
+    output.finish(display_sems)
+
+    with get_metrics().span('notify'):
+        await notifier.flush(session)
 
     update_data_file(display_sems)
+    get_fingerprint_index().save()
+    planner.save()
+    if get_config_val('hedge'):
+        get_hedger().save()
 
 
-def output_sems_format(semesters):
-    """Output semesters in the desired output format"""
-    if get_config_val('json'): # when "--json" is used
-        print(sems_to_json(semesters))
-        print("if line")
-        #pushbullet integration
-        #if (pushbullet_on ==True):
+class NdjsonOutput:
+    """One json object per result and line, written when the result arrives"""
+    def __init__(self, account=None):
+        self.account = account
 
-    else: # when "--new" or nothing is used
-        sems_pretty_print(semesters)
-        #push = pb.push_note("Neue Noten sind da!", sems_pretty_print(semesters) )#grade doesn´t work
-        #print("else line")
+    def add(self, sem, res):
+        data = { 'semester': sem.number, 'semester_name': sem.name, **res.get_output() }
+        if self.account:
+            data = { 'account': self.account, **data }
+        print(json.dumps(data), flush=True)
 
-def update_data_file(display_sems):
-    sems_d = sems_to_dict(display_sems)
-    old_sems_d = get_old_sems_dict()
-    old_sems_d.update(sems_d)
-    try:
-        with open(get_config_val('data'), 'w') as file:
-            json.dump(list(old_sems_d.values()), file, indent=4)
-    except IOError:
+    def finish(self, semesters):
         pass
 
+class JsonOutput:
+    """The json array needs all semesters in order, print it at the end
 
+    With several accounts every account prints one line: { "account": ..., "semesters": [...] }"""
+    def __init__(self, account=None):
+        self.account = account
+        self.shown = set()
 
-def aw_wrap(obj):
-    async def wrapper():
-        return obj
-    return wrapper
\ No newline at end of file
+    def add(self, sem, res):
+        self.shown.add(id(res))
+
+    def finish(self, semesters):
+        output = [sem.get_output([res for res in sem.result_infos if id(res) in self.shown]) for sem in semesters]
+        if self.account:
+            print(json.dumps({ 'account': self.account, 'semesters': output }), flush=True)
+        else:
+            print(json.dumps(output, indent=4))
+
+def get_output():
+    """Output for the desired output format"""
+    if get_config_val('serve'):
+        # results go to the http api instead
+        from dualisbot.server import get_snapshot
+        return get_snapshot()
+    # the accounts share stdout, label everything with the username
+    account = get_config_val('username') if get_config_val('accounts') else None
+    if get_config_val('ndjson'):
+        return NdjsonOutput(account)
+    if get_config_val('json'): # when "--json" is used
+        return JsonOutput(account)
+    # when "--new" or nothing is used
+    # Renderer prints results on a terminal when they arrive, in one write at the end otherwise
+    return Renderer(get_config_val('format') or default_format(), label=account)
+
+@timed('store')
+def update_data_file(display_sems):
+    # the store keeps the snapshot in memory for the next poll in daemon mode
+    get_store().save(display_sems)
+
+
+def page_loader(session, url):
+    """Load a page when it is needed, keeps only session and url alive until then"""
+    return lambda: PageInfo.init(session, url)
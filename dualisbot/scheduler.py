@@ -0,0 +1,101 @@
+import asyncio
+import random
+from urllib.parse import urlparse
+
+import aiohttp
+
+from dualisbot.config import get_config_val, account_cache
+from dualisbot.metrics import get_metrics
+from dualisbot.transport import get_transport
+
+# Limits the number of requests that are in flight, retries the ones that fail for transient reasons
+
+class RetryableStatus(Exception):
+    pass
+
+class RequestLimits:
+    """Limits shared by all accounts of the process"""
+    def __init__(self, max_requests, max_per_host):
+        self.total = asyncio.Semaphore(max_requests)
+        self.max_per_host = max_per_host
+        self.per_host = {}
+
+    def host_limit(self, url):
+        host = urlparse(url).netloc
+        if host not in self.per_host:
+            self.per_host[host] = asyncio.Semaphore(self.max_per_host)
+        return self.per_host[host]
+
+class RequestScheduler:
+    def __init__(self, shared_limits, max_requests, timeout, retries, backoff):
+        self.shared_limits = shared_limits
+        # limit for this account
+        self.account_limit = asyncio.Semaphore(max_requests)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            get_shared_limits(),
+            get_config_val('account_max_requests', get_config_val('max_requests', 8)),
+            get_config_val('request_timeout', 30),
+            get_config_val('retries', 3),
+            get_config_val('backoff', 0.5)
+        )
+
+    def retry_delay(self, attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def run(self, session, method, url, handler, on_slot=None, **kwargs):
+        """Send a request and pass the response to the coroutine function handler
+
+        The handler runs while the connection slot is held, its return value is returned.
+        Server errors, timeouts and broken connections are retried.
+        on_slot is called whenever the request has got its slot, before it is sent."""
+        attempt = 0
+        while True:
+            try:
+                limits = self.shared_limits
+                async with self.account_limit, limits.total, limits.host_limit(url):
+                    if on_slot is not None:
+                        on_slot()
+                    async with get_transport().request(session, method, url, timeout=self.timeout, **kwargs) as response:
+                        if response.status >= 500 and attempt < self.retries:
+                            raise RetryableStatus(response.status)
+                        return await handler(response)
+            except (RetryableStatus, aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.retry_delay(attempt))
+            attempt += 1
+
+
+def get_shared_limits():
+    """Create the limits on first use (they have to be created inside the event loop)"""
+    self = get_shared_limits
+    if getattr(self, 'cache', None) is None:
+        self.cache = RequestLimits(get_config_val('max_requests', 8), get_config_val('max_requests_per_host', 6))
+    return self.cache
+
+@account_cache
+def get_scheduler():
+    """One scheduler per account, created on first use inside the event loop"""
+    return RequestScheduler.from_config()
+
+def make_connector():
+    return aiohttp.TCPConnector(
+        ssl=False,
+        limit=get_config_val('max_requests', 8),
+        limit_per_host=get_config_val('max_requests_per_host', 6)
+    )
+
+def make_session(connector=None):
+    """Session with the request metrics hooks, closes the connector only if it creates it"""
+    return aiohttp.ClientSession(
+        connector=connector or make_connector(),
+        connector_owner=connector is None,
+        trace_configs=[get_metrics().trace_config()]
+    )
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+from collections import deque
+
+from aiohttp import web
+
+from dualisbot.config import get_config_val
+from dualisbot.daemon import run_daemon, poll_session
+from dualisbot.diff import NewResultFilter
+from dualisbot.resultdata import get_old_sems_dict
+
+# serve mode: the daemon polls Dualis and the results of the last poll are answered from memory
+# The number of clients does not change how often Dualis is polled
+#
+#   GET /semesters                                all semesters, like --json
+#   GET /semesters/<number>                       one semester
+#   GET /semesters/<number>/modules/<title>       one result
+#   GET /modules/<title>                          one result, with semester and semester_name
+#   GET /events                                   server-sent events, one 'result' event for every new result
+
+def encode(data):
+    """Response body and ETag"""
+    body = json.dumps(data).encode()
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class Snapshot:
+    """Output of do_output_io in serve mode, the responses are built once per poll"""
+    def __init__(self, history=1000):
+        # semester number -> Semester.get_output(), None until the first poll is done
+        self.semesters = None
+        # path -> (body, etag)
+        self.resources = {}
+        # (id, data) of the recent events, for clients that reconnect with Last-Event-ID
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        # set and replaced whenever there are new events
+        self.new_events = asyncio.Event()
+
+    def add(self, sem, res):
+        # everything is taken from finish, where all results of the poll are known
+        pass
+
+    def finish(self, semesters):
+        new_filter = NewResultFilter(self.semesters if self.semesters is not None else get_old_sems_dict())
+        for sem in semesters:
+            for res in sem.result_infos:
+                if not res.stale and new_filter.is_new(sem, res):
+                    self.publish({ 'semester': sem.number, 'semester_name': sem.name, **res.get_output() })
+        self.semesters = { **(self.semesters or {}), **{ sem.number: sem.get_output() for sem in semesters } }
+        self.build_resources()
+        self.new_events.set()
+        self.new_events = asyncio.Event()
+
+    def publish(self, data):
+        self.last_id += 1
+        self.events.append((self.last_id, json.dumps(data)))
+
+    def events_since(self, event_id):
+        return [event for event in self.events if event[0] > event_id]
+
+    def build_resources(self):
+        resources = { '/semesters': encode(list(self.semesters.values())) }
+        for number, sem in self.semesters.items():
+            resources[f'/semesters/{number}'] = encode(sem)
+            for res in sem['results']:
+                resources[f'/semesters/{number}/modules/{res["title"]}'] = encode(res)
+                resources[f'/modules/{res["title"]}'] = encode({ 'semester': number, 'semester_name': sem['name'], **res })
+        self.resources = resources
+
+
+def get_snapshot():
+    """One snapshot for the whole process"""
+    self = get_snapshot
+    if getattr(self, 'cache', None) is None:
+        self.cache = Snapshot()
+    return self.cache
+
+
+def etag_matches(etag, if_none_match):
+    return if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(','))
+
+class Api:
+    def __init__(self, snapshot, keepalive=30):
+        self.snapshot = snapshot
+        self.keepalive = keepalive
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/events', self.events)
+        # the titles may contain slashes, so look up the whole (decoded) path
+        app.router.add_get('/{path:.*}', self.get)
+        return app
+
+    async def get(self, request):
+        if self.snapshot.semesters is None:
+            raise web.HTTPServiceUnavailable(text='The first poll has not finished yet', headers={ 'Retry-After': '10' })
+        resource = self.snapshot.resources.get(request.path.rstrip('/'))
+        if resource is None:
+            raise web.HTTPNotFound()
+        body, etag = resource
+        if etag_matches(etag, request.headers.get('If-None-Match', '')):
+            return web.Response(status=304, headers={ 'ETag': etag })
+        return web.Response(body=body, content_type='application/json', headers={ 'ETag': etag })
+
+    async def events(self, request):
+        snapshot = self.snapshot
+        # without Last-Event-ID (or ?since=) only results that are new from now on are sent
+        try:
+            last_id = int(request.headers.get('Last-Event-ID') or request.query.get('since') or snapshot.last_id)
+        except ValueError:
+            raise web.HTTPBadRequest(text='Last-Event-ID and since have to be event ids')
+        response = web.StreamResponse(headers={ 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache' })
+        await response.prepare(request)
+        try:
+            while True:
+                new_events = snapshot.new_events
+                for event_id, data in snapshot.events_since(last_id):
+                    await response.write(f'id: {event_id}\nevent: result\ndata: {data}\n\n'.encode())
+                    last_id = event_id
+                try:
+                    await asyncio.wait_for(new_events.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    # comment line, keeps proxies from closing the connection
+                    await response.write(b': keepalive\n\n')
+        except ConnectionResetError:
+            pass
+        return response
+
+
+async def serve(session, on_first_poll=None):
+    """Start the HTTP API and poll forever"""
+    runner = web.AppRunner(Api(get_snapshot()).make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, get_config_val('host', 'localhost'), get_config_val('port', 8080))
+    await site.start()
+    try:
+        await run_daemon(poll_session(session), on_first_poll)
+    finally:
+        await runner.cleanup()
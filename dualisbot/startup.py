@@ -0,0 +1,37 @@
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+# Import times of the modules a normal poll loads, measured in a fresh interpreter
+
+startup_modules = ['dualisbot.webnav', 'dualisbot.resultdata', 'dualisbot.daemon', 'dualisbot.accounts']
+importtime_re = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+
+def parse_importtime(text):
+    """(module, self us, cumulative us, depth) for every line of python -X importtime"""
+    imports = []
+    for line in text.splitlines():
+        match = importtime_re.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+def profile_startup(modules=startup_modules, top=25):
+    """Print the slowest imports, False if the modules could not be imported"""
+    code = 'import ' + ', '.join(modules)
+    # in the repository, main.py may be run from anywhere (like the cronjob does)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                          cwd=Path(__file__).resolve().parent.parent)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        return False
+    imports = parse_importtime(proc.stderr)
+    print(f'{"module":50} {"self ms":>9} {"cumul. ms":>10}')
+    for module, self_us, cumulative_us, depth in sorted(imports, key=lambda i: -i[2])[:top]:
+        print(f'{module[:50]:50} {self_us / 1000:9.1f} {cumulative_us / 1000:10.1f}')
+    # only top level imports, the others are included in their cumulative time
+    total = sum(i[2] for i in imports if i[3] == 0)
+    print(f'{len(imports)} modules, {total / 1000:.1f} ms total')
+    return True
@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import time
+
+from dualisbot.config import get_config_val, data_file, account_cache
+from dualisbot.diff import diff_semester
+
+# Where the results of previous runs are kept
+# Both stores work with the serialized representation: semester number -> Semester.get_serializable()
+
+class JsonStore:
+    """The whole history in one json file, rewritten on every save"""
+    def __init__(self, path):
+        self.path = path
+        self.cache = None
+
+    def load(self):
+        """Get the stored semesters, the returned dict is shared, do not modify it"""
+        if self.cache is None:
+            try:
+                with open(self.path) as file:
+                    self.cache = { sem['number']: sem for sem in json.load(file) }
+            except IOError:
+                self.cache = {}
+        return self.cache
+
+    def save(self, semesters):
+        self.cache = { **self.load(), **{ sem.number: sem.get_serializable() for sem in semesters } }
+        try:
+            with open(self.path, 'w') as file:
+                json.dump(list(self.cache.values()), file, indent=4)
+        except IOError:
+            pass
+
+    def last_change(self, semester, title=None):
+        """The json file has no history"""
+        return None
+
+
+class SqliteStore:
+    """Only writes what has changed and keeps every value a result ever had"""
+    schema = '''
+        CREATE TABLE IF NOT EXISTS semesters (
+            number INTEGER PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS results (
+            semester INTEGER REFERENCES semesters(number),
+            title TEXT,
+            position INTEGER,
+            results TEXT,
+            final_results TEXT,
+            PRIMARY KEY (semester, title)
+        );
+        CREATE TABLE IF NOT EXISTS observations (
+            id INTEGER PRIMARY KEY,
+            semester INTEGER,
+            title TEXT,
+            observed_at REAL,
+            results TEXT,
+            final_results TEXT
+        );
+        CREATE INDEX IF NOT EXISTS observations_result ON observations (semester, title, observed_at);
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript(self.schema)
+        self.cache = None
+
+    def load(self):
+        """Get the stored semesters, the returned dict is shared, do not modify it"""
+        if self.cache is None:
+            self.cache = {
+                number: { 'name': name, 'number': number, 'results': [] }
+                for number, name in self.connection.execute('SELECT number, name FROM semesters')
+            }
+            rows = self.connection.execute(
+                'SELECT semester, title, results, final_results FROM results ORDER BY semester, position')
+            for semester, title, results, final_results in rows:
+                self.cache[semester]['results'].append(
+                    { 'title': title, 'results': json.loads(results), 'final_results': final_results })
+        return self.cache
+
+    def is_empty(self):
+        return self.connection.execute('SELECT count(*) FROM semesters').fetchone()[0] == 0
+
+    def save(self, semesters, observed_at=None):
+        """Upsert the changed semesters and results in one transaction"""
+        old = self.load()
+        observed_at = observed_at or time.time()
+        with self.connection:
+            for sem in semesters:
+                old_sem = old.get(sem.number)
+                if old_sem is None or old_sem['name'] != sem.name:
+                    self.connection.execute(
+                        'INSERT INTO semesters (number, name) VALUES (?, ?) '
+                        'ON CONFLICT (number) DO UPDATE SET name = excluded.name',
+                        (sem.number, sem.name))
+                diff = diff_semester(sem, old_sem)
+                positions = { id(res): i for i, res in enumerate(sem.result_infos) }
+                for res in diff.added + diff.changed:
+                    results = json.dumps(res.results)
+                    self.connection.execute(
+                        'INSERT INTO results (semester, title, position, results, final_results) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (semester, title) DO UPDATE SET '
+                        'position = excluded.position, results = excluded.results, final_results = excluded.final_results',
+                        (sem.number, res.title, positions[id(res)], results, res.final_results))
+                    self.connection.execute(
+                        'INSERT INTO observations (semester, title, observed_at, results, final_results) VALUES (?, ?, ?, ?, ?)',
+                        (sem.number, res.title, observed_at, results, res.final_results))
+                # results that only moved keep their row, but need their new position
+                stored_positions = dict(self.connection.execute(
+                    'SELECT title, position FROM results WHERE semester = ?', (sem.number,)))
+                for res in sem.result_infos:
+                    if stored_positions.get(res.title, positions[id(res)]) != positions[id(res)]:
+                        self.connection.execute(
+                            'UPDATE results SET position = ? WHERE semester = ? AND title = ?',
+                            (positions[id(res)], sem.number, res.title))
+                for res in diff.removed:
+                    self.connection.execute(
+                        'DELETE FROM results WHERE semester = ? AND title = ?', (sem.number, res['title']))
+        self.cache = { **old, **{ sem.number: sem.get_serializable() for sem in semesters } }
+
+    def first_seen(self, semester, title, final_results):
+        """Timestamp of the first run that saw final_results for this result, None if it never did"""
+        return self.connection.execute(
+            'SELECT min(observed_at) FROM observations WHERE semester = ? AND title = ? AND final_results = ?',
+            (semester, title, final_results)).fetchone()[0]
+
+    def last_change(self, semester, title=None):
+        """Timestamp of the newest observation of a semester (or one of its results), None if there is none"""
+        if title is None:
+            return self.connection.execute(
+                'SELECT max(observed_at) FROM observations WHERE semester = ?', (semester,)).fetchone()[0]
+        return self.connection.execute(
+            'SELECT max(observed_at) FROM observations WHERE semester = ? AND title = ?', (semester, title)).fetchone()[0]
+
+    def history(self, semester, title):
+        """All (timestamp, final_results) values a result has had, oldest first"""
+        return self.connection.execute(
+            'SELECT observed_at, final_results FROM observations WHERE semester = ? AND title = ? ORDER BY observed_at',
+            (semester, title)).fetchall()
+
+    def import_json(self, path):
+        """One-time import of a data.json file written by JsonStore"""
+        from dualisbot.resultdata import Semester
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (IOError, ValueError):
+            return
+        self.save([Semester.from_serializable(sem) for sem in data], observed_at=os.path.getmtime(path))
+
+
+@account_cache
+def get_store():
+    """Open the configured store once"""
+    if get_config_val('storage', 'sqlite') == 'json':
+        return JsonStore(get_config_val('data'))
+    store = SqliteStore(get_config_val('database') or data_file('data.sqlite'))
+    if store.is_empty() and os.path.exists(get_config_val('data')):
+        store.import_json(get_config_val('data'))
+    return store
@@ -0,0 +1,191 @@
+import asyncio
+import random
+import secrets
+import time
+
+from aiohttp import web
+
+# Local imitation of the parts of Dualis that get_semesters walks, for benchmarks and offline experiments
+
+dll = '/scripts/mgrqispi.dll'
+
+def page(body, head=''):
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8">{head}</head><body>{body}</body></html>'
+
+def mrefresh_page(relurl):
+    return page('', f'<meta http-equiv="refresh" content="0; URL={relurl}">')
+
+def grade(rng):
+    return rng.choice(['1,0', '1,3', '1,7', '2,0', '2,3', '2,7', '3,0', '3,3', '4,0', 'noch nicht gesetzt'])
+
+
+class Account:
+    """Synthetic student with semesters x modules results"""
+    def __init__(self, username, password, semesters, modules, seed=0):
+        self.username = username
+        self.password = password
+        rng = random.Random(seed)
+        # newest semester first, like the dropdown menu
+        self.semesters = []
+        for i in range(semesters, 0, -1):
+            name = f'{"WiSe" if i % 2 else "SoSe"} {2015 + i // 2}'
+            sem_id = f'{15000000 + i:015d}'
+            modules_ = [
+                { 'id': f'{sem_id[-6:]}{m:06d}', 'title': f'Modul {i}.{m} ({name})', 'grades': [grade(rng), grade(rng)] }
+                for m in range(1, modules + 1)
+            ]
+            self.semesters.append({ 'id': sem_id, 'name': name, 'modules': modules_ })
+
+    def change_grades(self, fraction, seed=None):
+        """Give a fraction of the modules of the newest semester a new grade"""
+        rng = random.Random(seed)
+        modules = self.semesters[0]['modules']
+        for module in rng.sample(modules, int(len(modules) * fraction)):
+            module['grades'][-1] = grade(rng)
+
+
+class StubDualis:
+    def __init__(self, accounts, latency=0.0, padding=0, error_rate=0.0, session_ttl=1800, seed=0,
+                 slow_rate=0.0, slow_latency=0.0):
+        self.accounts = { acc.username: acc for acc in accounts }
+        # seconds added to every response
+        self.latency = latency
+        # bytes of filler added to every page to imitate the size of the real pages
+        self.padding = padding
+        # fraction of requests answered with 503
+        self.error_rate = error_rate
+        # fraction of requests that take slow_latency longer, the long tail of the real server
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.session_ttl = session_ttl
+        self.rng = random.Random(seed)
+        # session number -> (account, cookie, last access)
+        self.sessions = {}
+        self.request_count = 0
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/', self.start)
+        app.router.add_get(dll, self.dispatch)
+        app.router.add_post(dll, self.logincheck)
+        return app
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_latency)
+        if self.rng.random() < self.error_rate:
+            return web.Response(status=503, text='Service Unavailable')
+        return await handler(request)
+
+    def html(self, text):
+        if self.padding:
+            text = text.replace('</body>', f'<!-- {"x" * self.padding} --></body>')
+        return web.Response(text=text, content_type='text/html', charset='utf-8')
+
+    def session(self, request):
+        """Get the account for the session in the request, None if it is invalid or expired"""
+        sessionno = request.query.get('ARGUMENTS', '').split(',')[0][2:]
+        account, cookie, last_access = self.sessions.get(sessionno, (None, None, 0))
+        if account is None or request.cookies.get('cnsc') != cookie or time.time() - last_access > self.session_ttl:
+            return None, sessionno
+        self.sessions[sessionno] = (account, cookie, time.time())
+        return account, sessionno
+
+    def url(self, prgname, *args):
+        return f'{dll}?APPNAME=CampusNet&PRGNAME={prgname}&ARGUMENTS=' + ','.join(args)
+
+    async def start(self, request):
+        return self.html(mrefresh_page(self.url('EXTERNALPAGES', '-N000000000000001', '-N000324', '-Awelcome')))
+
+    async def dispatch(self, request):
+        prgname = request.query.get('PRGNAME')
+        if prgname == 'EXTERNALPAGES':
+            return self.html(mrefresh_page(self.url('LOGINPAGE', '-N000000000000001', '-N000324')))
+        if prgname == 'LOGINPAGE':
+            return self.html(self.login_page())
+        account, sessionno = self.session(request)
+        if account is None:
+            return self.html(page('<h1>Zugang verweigert</h1>'))
+        if prgname == 'STARTPAGE_DISPATCH':
+            return self.html(mrefresh_page(self.url('MLSSTART', '-N' + sessionno, '-N000019')))
+        if prgname == 'MLSSTART':
+            return self.html(self.main_page(sessionno))
+        if prgname == 'COURSERESULTS':
+            return self.html(self.semester_page(account, sessionno, request.query['ARGUMENTS'].split(',')))
+        if prgname == 'RESULTDETAILS':
+            return self.html(self.popup_page(account, request.query['ARGUMENTS'].split(',')[2][2:]))
+        raise web.HTTPNotFound()
+
+    def login_page(self):
+        inputs = ''.join(
+            f'<input type="hidden" name="{name}" value="{value}">'
+            for name, value in [('APPNAME', 'CampusNet'), ('PRGNAME', 'LOGINCHECK'), ('ARGUMENTS', 'clino,usrname,pass,menuno'),
+                                ('clino', '000000000000001'), ('menuno', '000324')])
+        return page(f'<form id="cn_loginForm" action="{dll}" method="post">{inputs}'
+                    '<input name="usrname" type="text"><input name="pass" type="password"></form>')
+
+    async def logincheck(self, request):
+        data = await request.post()
+        account = self.accounts.get(data.get('usrname'))
+        if account is None or account.password != data.get('pass'):
+            return self.html(page('Benutzername oder Passwort falsch'))
+        sessionno = f'{secrets.randbelow(10 ** 15):015d}'
+        cookie = secrets.token_hex(8)
+        self.sessions[sessionno] = (account, cookie, time.time())
+        response = self.html(page(''))
+        response.set_cookie('cnsc', cookie)
+        response.headers['REFRESH'] = '0; URL=' + self.url('STARTPAGE_DISPATCH', '-N' + sessionno, '-N000019', '-N000000000000000')
+        return response
+
+    def navigation(self, sessionno):
+        return (f'<div id="pageTopNavi"><ul><li><a href="{self.url("MLSSTART", "-N" + sessionno, "-N000019")}">Startseite</a></li>'
+                f'<li><a href="{self.url("COURSERESULTS", "-N" + sessionno, "-N000307", "")}">Prüfungsergebnisse</a></li></ul></div>')
+
+    def main_page(self, sessionno):
+        return page(self.navigation(sessionno) + '<h1>Willkommen</h1>')
+
+    def semester_page(self, account, sessionno, arguments):
+        sem_id = arguments[2][2:] if len(arguments) > 2 and arguments[2] else account.semesters[0]['id']
+        semester = next((sem for sem in account.semesters if sem['id'] == sem_id), account.semesters[0])
+        selected = ' selected="selected"'
+        options = ''.join(
+            f'<option value="{sem["id"]}"{selected if sem is semester else ""}>{sem["name"]}</option>'
+            for sem in account.semesters)
+        inputs = ''.join(
+            f'<input type="hidden" name="{name}" value="{value}">'
+            for name, value in [('APPNAME', 'CampusNet'), ('PRGNAME', 'COURSERESULTS'), ('ARGUMENTS', 'sessionno,menuno,semester'),
+                                ('sessionno', sessionno), ('menuno', '000307')])
+        rows = ''.join(
+            f'<tr><td>{module["title"]}</td><td>{module["grades"][-1]}</td>'
+            f'<td><a id="Popup_details{module["id"]}" href="{self.url("RESULTDETAILS", "-N" + sessionno, "-N000307", "-N" + module["id"])}">'
+            'Prüfungen</a></td></tr>'
+            for module in semester['modules'])
+        return page(f'{self.navigation(sessionno)}<form><select id="semester" name="semester">{options}</select>{inputs}</form>'
+                    f'<table>{rows}</table>')
+
+    def popup_page(self, account, module_id):
+        module = next(
+            (module for sem in account.semesters for module in sem['modules'] if module['id'] == module_id), None)
+        if module is None:
+            raise web.HTTPNotFound()
+        cells = lambda cls, values: '<tr>' + ''.join(f'<td class="{cls}">{value}</td>' for value in values) + '</tr>'
+        rows = [cells('tbsubhead', ['Versuch', 'Prüfung', 'Datum', 'Bewertung'])]
+        rows += [cells('tbdata', [str(i + 1), 'Klausur (100%)', '01.02.2020', grade]) for i, grade in enumerate(module['grades'])]
+        rows.append(cells('level00', ['Gesamt', '', '', module['grades'][-1]]))
+        return page(f'<h1>\n{module["title"]}</h1><table>{"".join(rows)}</table>')
+
+
+async def start_server(stub, host='localhost', port=0):
+    """Start serving, returns the runner (for cleanup) and the base url
+
+    Use a host name, aiohttp does not store cookies sent by ip addresses"""
+    runner = web.AppRunner(stub.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
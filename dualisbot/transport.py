@@ -0,0 +1,164 @@
+import asyncio
+import base64
+import gzip
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from urllib.parse import unquote_plus
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from dualisbot.config import get_config_val
+from dualisbot.fingerprint import url_key
+
+# What the scheduler sends its requests through
+# passthrough: the server, record: the server and every exchange is appended to an archive,
+# replay: the exchanges of an archive, no network at all
+
+archive_name = 'exchanges.jsonl.gz'
+scrubbed = 'scrubbed'
+
+class ReplayMiss(aiohttp.ClientError):
+    """The archive has no response for a request"""
+
+
+class RecordedContent:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self.body), n):
+            yield self.body[i:i + n]
+
+class RecordedResponse:
+    """The parts of aiohttp.ClientResponse the handlers use, for a response that has already been read"""
+    def __init__(self, method, url, status, headers, body):
+        self.method = method
+        self.url = URL(url)
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.body = body
+        self.content = RecordedContent(body)
+
+    @property
+    def charset(self):
+        return aiohttp.helpers.parse_mimetype(self.headers.get('Content-Type', '')).parameters.get('charset')
+
+    async def read(self):
+        return self.body
+
+    async def text(self, encoding=None):
+        return self.body.decode(encoding or self.charset or 'utf-8', errors='replace')
+
+    async def json(self, **kwargs):
+        return json.loads(await self.text())
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            request_info = aiohttp.RequestInfo(self.url, self.method, CIMultiDictProxy(CIMultiDict()), self.url)
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, headers=self.headers)
+
+
+class Passthrough:
+    def request(self, session, method, url, **kwargs):
+        return session.request(method, url, **kwargs)
+
+def secrets():
+    return [secret for secret in (get_config_val('username'), get_config_val('password')) if secret]
+
+class Recorder:
+    """Passes requests on and appends every exchange to the archive
+
+    Request bodies and headers are not stored. Cookie values and query parameters that are exactly a credential
+    are replaced, nothing else is touched so the urls still match when replaying"""
+    def __init__(self, directory):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.path = Path(directory) / archive_name
+        # a new recording
+        self.path.unlink(missing_ok=True)
+
+    def scrub_url(self, url):
+        base, sep, query = url.partition('?')
+        if not sep:
+            return url
+        def scrub_param(param):
+            name, eq, value = param.partition('=')
+            return f'{name}={scrubbed}' if eq and unquote_plus(value) in secrets() else param
+        return base + sep + '&'.join(map(scrub_param, query.split('&')))
+
+    def scrub_header(self, name, value):
+        name = name.lower()
+        if name == 'set-cookie':
+            return f'{value.split("=", 1)[0]}={scrubbed}'
+        if name == 'cookie':
+            return '; '.join(f'{cookie.split("=", 1)[0]}={scrubbed}' for cookie in value.split('; '))
+        if name in ('location', 'refresh'):
+            return self.scrub_url(value)
+        return value
+
+    def save(self, response, duration):
+        entry = {
+            'method': response.method,
+            'url': self.scrub_url(str(response.url)),
+            'status': response.status,
+            'headers': [[name, self.scrub_header(name, value)] for name, value in response.headers.items()],
+            'body': base64.b64encode(response.body).decode(),
+            'duration': duration
+        }
+        try:
+            # one gzip member per exchange, gzip.open reads them as one stream
+            with gzip.open(self.path, 'at') as file:
+                file.write(json.dumps(entry) + '\n')
+        except IOError:
+            pass
+
+    @asynccontextmanager
+    async def request(self, session, method, url, **kwargs):
+        start = time.perf_counter()
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            recorded = RecordedResponse(method, url, response.status, list(response.headers.items()), body)
+        self.save(recorded, time.perf_counter() - start)
+        yield recorded
+
+class Player:
+    """Answers requests from an archive in the order they were recorded
+
+    Requests are matched by method and url without the session number. When the recorded responses
+    for a url are used up, the last one is repeated."""
+    def __init__(self, directory, latency=0.0):
+        self.latency = latency
+        self.exchanges = defaultdict(deque)
+        with gzip.open(Path(directory) / archive_name, 'rt') as file:
+            for line in file:
+                entry = json.loads(line)
+                self.exchanges[entry['method'], url_key(entry['url'])].append(entry)
+
+    @asynccontextmanager
+    async def request(self, session, method, url, **kwargs):
+        entries = self.exchanges.get((method, url_key(str(url))))
+        if not entries:
+            raise ReplayMiss(f'No recorded response for {method} {url}')
+        entry = entries.popleft() if len(entries) > 1 else entries[0]
+        await asyncio.sleep(entry['duration'] if self.latency == 'recorded' else self.latency)
+        yield RecordedResponse(method, entry['url'], entry['status'], entry['headers'], base64.b64decode(entry['body']))
+
+
+def get_transport():
+    """One transport for the whole process, chosen with the record and replay config values"""
+    self = get_transport
+    if getattr(self, 'cache', None) is None:
+        if get_config_val('replay'):
+            self.cache = Player(get_config_val('replay'), get_config_val('replay_latency', 0.0))
+        elif get_config_val('record'):
+            self.cache = Recorder(get_config_val('record'))
+        else:
+            self.cache = Passthrough()
+    return self.cache
+
+def recording_or_replaying():
+    return bool(get_config_val('record') or get_config_val('replay'))
@@ -1,39 +1,28 @@
 import json
 import re
+import time
 from urllib.parse import urlparse, urlunparse
 
 import aiohttp
-from lxml import html
+from lxml import etree
+from yarl import URL
 
-from dualisbot.config import get_config_val
-from dualisbot.resultdata import Semester
+from dualisbot.config import get_config_val, data_file
+from dualisbot.fingerprint import session_number
+from dualisbot.pages import PageInfo, fetch, relurl_to_url
+from dualisbot.resultdata import Semester, count_following_options, find_selected_option, page_loader
+from dualisbot.transport import recording_or_replaying
 
 # Functions for navigation the websites and extracting links
 
-class PageInfo:
-    def __init__(self, session, url, page):
-        self.session = session
-        self.url = url 
-        self.page = page
-
-    @classmethod
-    async def init(cls, session, url):
-        async with session.get(url) as response:
-            page = html.fromstring(await response.text())
-            return cls(session, url, page)
-
-    @classmethod
-    async def copy_session(cls, pageinfo, url):
-        return await cls.init(pageinfo.session, url)
-
-    @classmethod
-    async def from_relurl(cls, session, relurl, base_url):
-        return await cls.init(session, relurl_to_url(relurl, base_url))
-    
-    @classmethod
-    async def copy_relurl(cls, pageinfo, relurl):
-        return await cls.from_relurl(pageinfo.session, relurl, pageinfo.url)
-    
+find_login_form = etree.XPath('//form[@id = "cn_loginForm"]')
+find_inputs = etree.XPath('.//input')
+find_navigation = etree.XPath('//div[@id = "pageTopNavi"]')
+find_navigation_links = etree.XPath('//div[@id = "pageTopNavi"]//a/@href', smart_strings=False)
+find_mrefresh_content = etree.XPath('//meta[@http-equiv = "refresh"]/@content', smart_strings=False)
+find_options = etree.XPath('//option')
+find_hidden_inputs = etree.XPath('//input[@type = "hidden"]')
+mrefresh_urlstart = re.compile('.*URL=')
 
 def follow_mrefresh(pageinfo):
     return PageInfo.copy_session(pageinfo, get_mrefresh_url(pageinfo.page, pageinfo.url))
@@ -43,16 +32,20 @@ async def login(pageinfo):
     relurl, header = get_login_data(pageinfo.page)
     url = relurl_to_url(relurl, pageinfo.url)
     # send it
-    async with pageinfo.session.post(url, data=header) as response:
+    async def get_refresh(response):
         # parse response
         if response.headers.get('Set-cookie'):
-            return await PageInfo.from_relurl(pageinfo.session, mrefresh_to_relurl(response.headers['REFRESH']), url)
-    raise LoginFailed('Incorrect username or password')
+            return mrefresh_to_relurl(response.headers['REFRESH'])
+        return None
+    relurl = await fetch(pageinfo.session, url, get_refresh, method='POST', data=header)
+    if relurl is None:
+        raise LoginFailed('Incorrect username or password')
+    return await PageInfo.from_relurl(pageinfo.session, relurl, url)
 
 def get_login_data(page):
     """Extract the path to the serverside script and the input form data from the Dualis login page"""
-    form = page.xpath('//form[@id = "cn_loginForm"]')[0]
-    inputs = form.xpath('.//input')
+    form = find_login_form(page)[0]
+    inputs = find_inputs(form)
     header = { i.name: i.value for i in inputs if i.name is not None }
     header.update({ 'usrname': get_config_val('username'), 'pass': get_config_val('password') })
     return form.action, header
@@ -61,67 +54,187 @@ def go_to_semester_page(pageinfo):
     """Use the menu to get to the semester overview page"""
     # don't use the link id because it looks automatically generated
     # let's hope they don't change the layout
-    relurl = pageinfo.page.xpath('//div[@id = "pageTopNavi"]//a/@href')[1]
+    relurl = find_navigation_links(pageinfo.page)[1]
     return PageInfo.copy_relurl(pageinfo, relurl)
 
+def is_logged_in(pageinfo):
+    """Check whether a page was served inside a valid session (it has the navigation bar)"""
+    return bool(find_navigation(pageinfo.page))
+
 class LoginFailed(Exception):
     pass
 
 def get_mrefresh_content(page):
     """Get the link of the metarefresh tag if it exists"""
-    tags = page.xpath('//meta[@http-equiv = "refresh"]/@content')
+    tags = find_mrefresh_content(page)
     return tags[0]
 
 def mrefresh_to_relurl(content):
     """Get a relative url from the contents of a metarefresh tag"""
-    urlstart = re.compile('.*URL=')
     _, url = content.split(';')
-    url = urlstart.sub('', url)
+    url = mrefresh_urlstart.sub('', url)
     return url
 
-def relurl_to_url(relurl, base_url):
-    """Append a page-relative url to a full url"""
-    relurl = urlparse(relurl)
-    base_url = urlparse(base_url)
-    return urlunparse(base_url[:2] + relurl[2:])
-
 def get_mrefresh_url(page, url):
     return relurl_to_url(mrefresh_to_relurl(get_mrefresh_content(page)), url)
 
+class SemesterMap:
+    """Semester number -> id and name, and how to build the url of a semester page in any session"""
+    def __init__(self, base_url, args, semesters, saved=None):
+        self.base_url = base_url
+        # hidden inputs of the form, 'sessionno' and 'semester' in ARGUMENTS are replaced when building a url
+        self.args = args
+        # in the order of the dropdown menu
+        self.semesters = semesters
+        self.saved = saved or time.time()
+
+    @classmethod
+    def from_pageinfo(cls, pageinfo):
+        # Looks like Hansel and Gretel were short on pebbles this time
+        # the dropdown menu only contains the semester-id, the other parts of the url
+        # are inside the hidden input tags
+        page = pageinfo.page
+        args = { i.name : i.value for i in find_hidden_inputs(page) }
+        # the session number is inserted later, the menu number stays the same
+        args['ARGUMENTS'] = args['ARGUMENTS'].replace('menuno', '-N' + args['menuno'])
+        del args['sessionno'], args['menuno']
+        semesters = {}
+        for opt in find_options(page):
+            # First semester is at the bottom of the drop-down menu, therefore count following option
+            number = int(count_following_options(opt)) + 1
+            semesters[number] = { 'id': opt.attrib['value'], 'name': opt.text }
+        return cls(pageinfo.url, args, semesters)
+
+    @classmethod
+    def from_serializable(cls, data):
+        semesters = { int(number): sem for number, sem in data['semesters'].items() }
+        return cls(data['base_url'], data['args'], semesters, data['saved'])
+
+    def get_serializable(self):
+        return { 'saved': self.saved, 'base_url': self.base_url, 'args': self.args, 'semesters': self.semesters }
+
+    def url(self, number, sessionno):
+        # Construct query string
+        urlargs = '&'.join(f'{key}={value}' for key, value in self.args.items())
+        urlargs = urlargs.replace('sessionno', '-N' + sessionno).replace('semester', '-N' + self.semesters[number]['id'])
+        # Use other parts from the url of the page the map was read from
+        return urlunparse(urlparse(self.base_url)._replace(query=urlargs))
+
+def semester_map_path():
+    return get_config_val('semester_map') or data_file('semesters.json')
+
+def load_semester_map():
+    """Read the stored semester map, None if there is none or it is older than semester_map_ttl"""
+    try:
+        with open(semester_map_path()) as file:
+            semester_map = SemesterMap.from_serializable(json.load(file))
+    except (IOError, ValueError, KeyError):
+        return None
+    if time.time() - semester_map.saved > get_config_val('semester_map_ttl', 7 * 86400):
+        return None
+    return semester_map
+
+def save_semester_map(semester_map):
+    try:
+        with open(semester_map_path(), 'w') as file:
+            json.dump(semester_map.get_serializable(), file, indent=4)
+    except IOError:
+        pass
+
+def semester_url(number, url):
+    """Url of the page of semester number in the session of url, None if the semester map does not know it"""
+    semester_map = load_semester_map() if number is not None else None
+    sessionno = session_number(url)
+    if semester_map is None or sessionno is None or number not in semester_map.semesters:
+        return None
+    return semester_map.url(number, sessionno)
+
 def parse_dropdown_menu(semester):
     """Get all semesters from the dropdown menu"""
-    # Looks like Hansel and Gretel were short on pebbles this time
-    # the dropdown menu only contains the semester-id, the other parts of the url
-    # are inside the hidden input tags
-    page = semester.pageinfo.page
-    options = page.xpath('//option[not(@selected)]')
-    inputs = page.xpath('//input[@type = "hidden"]')
-    args = { i.name : i.value for i in inputs }
-    # special case for arguments
-    for key in 'sessionno', 'menuno':
-        args['ARGUMENTS'] = args['ARGUMENTS'].replace(key, '-N' + args[key])
-        del args[key]
+    semester_map = SemesterMap.from_pageinfo(semester.pageinfo)
+    # every semester page has the whole dropdown, so the stored map is always the current one
+    save_semester_map(semester_map)
+    sessionno = session_number(semester.pageinfo.url)
     result = [semester]
-    for opt in options:
-        # Construct query string
-        urlargs = '&'.join(f'{key}={value}' for key, value in args.items())
-        urlargs = urlargs.replace('semester', '-N' + opt.attrib['value'])
-        # Use other parts from current url
-        urlp = urlparse(semester.pageinfo.url)
-        urlp = urlp._replace(query=urlargs)
-        # First semester is at the bottom of the drop-down menu, therefore count following option
-        number = len(opt.xpath('./following-sibling::option')) + 1
-        # Inner lambda: wrap Pageinfo.copy_session in closure because asyncio complains about unused awaitables and
-        # it may not be awaited
-        # Outer lambda: Prevents scoping issues
-        async_get_pageinfo = (lambda urlp: lambda: PageInfo.copy_session(semester.pageinfo, urlunparse(urlp)))(urlp)
-        result.append(Semester(opt.text, number, async_get_pageinfo))
+    for number, sem in semester_map.semesters.items():
+        if number == semester.number:
+            continue
+        # The page may never be loaded, so don't create the coroutine yet
+        # page_loader does not hold on to the first semester and its tree
+        async_get_pageinfo = page_loader(semester.pageinfo.session, semester_map.url(number, sessionno))
+        result.append(Semester(sem['name'], number, async_get_pageinfo))
     return result
 
-async def get_semesters(session):
+async def log_in(session):
+    """Walk through the login chain and return the main page"""
     start = await PageInfo.init(session, get_config_val('url'))
     login_page = await follow_mrefresh(await follow_mrefresh(start)) # Two redirects
-    main_page = await follow_mrefresh(await login(login_page))
-    semester = Semester.from_pageinfo(await go_to_semester_page(main_page))
+    return await follow_mrefresh(await login(login_page))
+
+def session_cache_path():
+    return get_config_val('session_cache') or data_file('session.json')
+
+def load_session_cache():
+    """Read the stored session, returns None if there is none or it is older than session_ttl"""
+    try:
+        with open(session_cache_path()) as file:
+            cache = json.load(file)
+    except (IOError, ValueError):
+        return None
+    if time.time() - cache.get('saved', 0) > get_config_val('session_ttl', 1800):
+        return None
+    return cache
+
+def save_session_cache(session, semester_page):
+    cache = {
+        'saved': time.time(),
+        'semester_url': semester_page.url,
+        'cookies': { morsel.key: morsel.value for morsel in session.cookie_jar }
+    }
+    try:
+        with open(session_cache_path(), 'w') as file:
+            json.dump(cache, file, indent=4)
+    except IOError:
+        pass
+
+async def resume_session(session, number=None):
+    """Try to get to the semester page with the cached session, returns None if Dualis rejects it"""
+    cache = load_session_cache()
+    if cache is None:
+        return None
+    url = semester_url(number, cache['semester_url']) or cache['semester_url']
+    session.cookie_jar.update_cookies(cache['cookies'], URL(url))
+    semester_page = await PageInfo.init(session, url)
+    if is_logged_in(semester_page):
+        # Dualis counts the timeout from the last request
+        save_session_cache(session, semester_page)
+        return semester_page
+    session.cookie_jar.clear()
+    return None
+
+def go_to_semester(pageinfo, number=None):
+    """Go straight to the page of semester number if the semester map knows it, to the overview otherwise"""
+    url = semester_url(number, pageinfo.url)
+    if url is None:
+        return go_to_semester_page(pageinfo)
+    return PageInfo.copy_session(pageinfo, url)
+
+async def get_semester_page(session, number=None):
+    """Get the semester overview page (or the page of semester number), logs in only if the cached session is not valid anymore"""
+    # recordings always contain the whole login, and replays must not touch the stored session
+    if recording_or_replaying():
+        return await go_to_semester(await log_in(session), number)
+    semester_page = await resume_session(session, number)
+    if semester_page is None:
+        semester_page = await go_to_semester(await log_in(session), number)
+        save_session_cache(session, semester_page)
+    return semester_page
+
+async def get_semesters(session):
+    semester_page = await get_semester_page(session, get_config_val('semester'))
+    if not find_selected_option(semester_page.page):
+        # the semester map points to a semester that does not exist anymore
+        semester_page = await go_to_semester_page(semester_page)
+    semester = Semester.from_pageinfo(semester_page)
     semesters = parse_dropdown_menu(semester)
-    return semesters
\ No newline at end of file
+    return semesters
@@ -3,21 +3,60 @@
 import asyncio
 import sys
 
-import aiohttp
-
+# Only the argument parsing is imported up front, so --help and --profile-startup stay fast
 from dualisbot.cmdline import parse_args
-from dualisbot.config import read_config, save_credentials
-from dualisbot.webnav import get_semesters, LoginFailed
-from dualisbot.resultdata import do_output_io
+from dualisbot.config import read_config, load_config, read_accounts, save_credentials, get_config_val
+
+async def main_accounts():
+    """Poll every account of the accounts file, credentials are never read from input"""
+    from dualisbot.accounts import poll_accounts
+    from dualisbot.daemon import run_daemon
+    from dualisbot.metrics import get_metrics
+    from dualisbot.scheduler import make_connector
+
+    load_config()
+    accounts = read_accounts(get_config_val('accounts'))
+    connector = make_connector()
+    try:
+        if get_config_val('daemon'):
+            await run_daemon(lambda: poll_accounts(accounts, connector))
+        else:
+            await poll_accounts(accounts, connector)
+            get_metrics().finish_poll()
+    finally:
+        await connector.close()
 
 async def main():
     parse_args()
+    if get_config_val('profile_startup'):
+        from dualisbot.startup import profile_startup
+        if not profile_startup():
+            sys.exit(1)
+        return
+    if get_config_val('accounts'):
+        await main_accounts()
+        return
     read_config()
 
+    import aiohttp
+    from dualisbot.webnav import get_semesters, LoginFailed
+    from dualisbot.resultdata import do_output_io
+    from dualisbot.daemon import run_daemon, poll_session
+    from dualisbot.scheduler import make_session
+    from dualisbot.metrics import get_metrics
+
     try:
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            sems = await get_semesters(session)
-            await do_output_io(session, sems)
+        async with make_session() as session:
+            if get_config_val('serve'):
+                from dualisbot.server import serve
+                await serve(session, save_credentials)
+            elif get_config_val('daemon'):
+                # never returns, saves the credentials after the first poll
+                await run_daemon(poll_session(session), save_credentials)
+            else:
+                sems = await get_semesters(session)
+                await do_output_io(session, sems)
+                get_metrics().finish_poll()
     except aiohttp.client_exceptions.ClientConnectorError:
         print("Failure establishing network connection. Please try reversing the polarity of the wifi cable.", file=sys.stderr)
         sys.exit(1)
@@ -33,4 +72,4 @@ if __name__ == '__main__':
         asyncio.run(main())
     except KeyboardInterrupt:
         # don't print stacktrace
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,53 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dualisbot.config import config
+from dualisbot.scheduler import make_session
+from dualisbot.stubserver import StubDualis, Account, start_server
+from dualisbot.webnav import get_semester_page, is_logged_in
+
+# The stored session is reused between runs (every run has its own ClientSession, like the cronjob)
+# and the bot logs in again once the server or the cache considers it expired
+
+async def poll():
+    async with make_session() as session:
+        page = await get_semester_page(session)
+        assert is_logged_in(page)
+
+def test_session_cache(tmp_path, monkeypatch):
+    async def run():
+        stub = StubDualis([Account('user', 'secret', 2, 3)])
+        runner, url = await start_server(stub)
+        for key, value in dict(url=url, username='user', password='secret', data=tmp_path / 'data.json').items():
+            monkeypatch.setitem(config, key, value)
+        monkeypatch.setattr(config, 'cache', {})
+        try:
+            await poll()
+            assert len(stub.sessions) == 1
+            assert (tmp_path / 'session.json').exists()
+
+            # resumed, no new login
+            await poll()
+            assert len(stub.sessions) == 1
+
+            # the server has expired the session
+            stub.sessions = { sessionno: (account, cookie, 0) for sessionno, (account, cookie, _) in stub.sessions.items() }
+            await poll()
+            assert len(stub.sessions) == 2
+
+            # resumed again with the new session
+            await poll()
+            assert len(stub.sessions) == 2
+
+            # the cache is too old, even though the server would still accept it
+            monkeypatch.setitem(config, 'session_ttl', 0)
+            await asyncio.sleep(0.01)
+            await poll()
+            assert len(stub.sessions) == 3
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())